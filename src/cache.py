@@ -0,0 +1,212 @@
+## Copyright (c) 2007 Ashish Kulkarni
+##
+## Permission is hereby granted, free of charge, to any person obtaining a
+## copy of this software and associated documentation files (the "Software"),
+## to deal in the Software without restriction, including without limitation
+## the rights to use, copy, modify, merge, publish, distribute, sublicense,
+## and/or sell copies of the Software, and to permit persons to whom the
+## Software is furnished to do so, subject to the following conditions:
+##
+## The above copyright notice and this permission notice shall be included in
+## all copies or substantial portions of the Software.
+##
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+## IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+## FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+## AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+## LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+## FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+## DEALINGS IN THE SOFTWARE.
+
+
+import os, shutil, tempfile, hashlib, Image
+
+########################################################### CONSTANTS
+
+## bump this whenever a change in processing alters the generated images
+CACHE_VERSION  = 1
+
+## every option which affects the pixels of the rasterized pages
+RASTER_OPTIONS = ['in_format', 'dpi', 'colorspace', 'extract_images',
+                  'render_region']
+
+## every option which affects the pixels of the generated images
+PAGE_OPTIONS   = ['in_format', 'dpi', 'colorspace', 'extract_images',
+                  'render_region', 'crop_percent', 'unpaper_args', 'no_crop',
+                  'no_dilate', 'dilation', 'mode', 'hres', 'vres', 'rotate',
+                  'colors', 'edge_level', 'no_enhance', 'overlap_h',
+                  'overlap_v', 'optimize', 'optimizer', 'engine', 'quantizer',
+                  'dither']
+
+## returned from the page cache for a page which produced no images at all
+BLANK_PAGE     = 'BLANK'
+
+## the empty file whose entry marks a blank page
+BLANK_FILE     = 'page_b.blank'
+
+## the share of its maximum size a full cache is evicted down to, so that
+## it is not scanned again for every entry added
+CACHE_LOW_WATER = 0.9
+
+########################################################### METHODS
+
+""" compute the hash of a file's contents """
+def file_hash(name):
+  digest = hashlib.sha1()
+  f = open(name, 'rb')
+  data = f.read(1 << 20)
+  while data:
+    digest.update(data)
+    data = f.read(1 << 20)
+  f.close()
+  return digest.hexdigest()
+
+""" the values of some options identifying a cache entry; the region found
+    by --render-region covers the whole range of pages, so that is added """
+def options_key(options, names):
+  key = tuple([ options.get(name) for name in names ])
+  if options.get('render_region'):
+    key += (options.get('first_page'), options.get('last_page'))
+  return key
+
+""" total size of the files in a directory """
+def dir_size(path):
+  return sum([ os.path.getsize(os.path.join(path, name))
+               for name in os.listdir(path) ])
+
+###################################################### CACHE CLASSES
+
+""" a directory of cached file sets, evicting the least recently used ones """
+class DiskCache(object):
+
+  """ initialise """
+  def __init__(self, path, max_size):
+    self.path, self.max_size = os.path.abspath(path), max_size
+    if not os.path.isdir(self.path):
+      os.makedirs(self.path)
+
+    self.size = sum([ dir_size(entry) for entry in self.entries() ])
+
+  """ the entry directories currently in the cache """
+  def entries(self):
+    entries = []
+    for bucket in os.listdir(self.path):
+      bucket = os.path.join(self.path, bucket)
+      if os.path.isdir(bucket):
+        entries.extend([ os.path.join(bucket, name)
+                         for name in os.listdir(bucket)
+                         if not name.startswith('tmp') ])
+    return entries
+
+  """ the directory of the entry for a key """
+  def entry(self, *key):
+    digest = hashlib.sha1(repr((CACHE_VERSION,) + key)).hexdigest()
+    return os.path.join(self.path, digest[:2], digest)
+
+  """ get the files stored for a key, or None if it is not cached """
+  def get(self, *key):
+    entry = self.entry(*key)
+    if not os.path.isdir(entry):
+      return None
+
+    # mark the entry as recently used
+    os.utime(entry, None)
+    names = os.listdir(entry)
+    names.sort()
+    return [ os.path.join(entry, name) for name in names ]
+
+  """ store copies of files for a key """
+  def put(self, files, *key):
+    entry  = self.entry(*key)
+    bucket = os.path.dirname(entry)
+    if os.path.isdir(entry):
+      return
+
+    if not os.path.isdir(bucket):
+      os.makedirs(bucket)
+
+    # build the entry aside, so that it appears complete or not at all
+    temp = tempfile.mkdtemp(prefix='tmp', dir=bucket)
+    for i, name in enumerate(files):
+      shutil.copyfile(name, os.path.join(temp, '%05d%s' %
+                                         (i, os.path.splitext(name)[1])))
+
+    try:
+      os.rename(temp, entry)
+      self.size += dir_size(entry)
+    except OSError:
+      shutil.rmtree(temp, True)
+
+    if self.size > self.max_size:
+      self.evict()
+
+  """ remove the least recently used entries until the cache is back below
+      its low water mark """
+  def evict(self):
+    entries = [ (os.path.getmtime(entry), entry) for entry in self.entries() ]
+    entries.sort()
+
+    self.size = sum([ dir_size(entry) for mtime, entry in entries ])
+    for mtime, entry in entries:
+      if self.size <= self.max_size * CACHE_LOW_WATER:
+        break
+
+      self.size -= dir_size(entry)
+      shutil.rmtree(entry, True)
+
+""" cache of the generated images for the pages of a document, keeping
+    the entries of one profile in a disk cache shared by all of them """
+class PageCache(object):
+
+  """ initialise """
+  def __init__(self, cache, digest, options):
+    self.cache = cache
+    self.key   = (digest,) + options_key(options, PAGE_OPTIONS)
+
+  """ get the files of a page, BLANK_PAGE for a blank page or None if it is
+      not cached """
+  def get_page(self, page):
+    files = self.cache.get(page, *self.key)
+    if files and files[0].endswith(os.path.splitext(BLANK_FILE)[1]):
+      return BLANK_PAGE
+    return files
+
+  """ store the files of a page, or a marker if the page is blank """
+  def put_page(self, page, files):
+    if files is not None:
+      self.cache.put(files, page, *self.key)
+      return
+
+    open(BLANK_FILE, 'wb').close()
+    self.cache.put([BLANK_FILE], page, *self.key)
+    os.remove(BLANK_FILE)
+
+""" cache of the rasterized pages of a document, shared by all profiles """
+class RasterCache(DiskCache):
+
+  """ initialise, wrapping an input """
+  def __init__(self, path, max_size, input, digest, options):
+    DiskCache.__init__(self, path, max_size)
+    self.input = input
+    self.key   = (digest,) + options_key(options, RASTER_OPTIONS)
+
+  """ everything else is delegated to the input """
+  def __getattr__(self, name):
+    return getattr(self.input, name)
+
+  """ get a page, rasterizing it only if it is not cached """
+  def get_page(self, n):
+    files = self.get(n, *self.key)
+    if files:
+      image = Image.open(files[0])
+      image.load()
+      return image
+
+    # PNG keeps the raster exact at a fraction of the size of a PNM
+    image = self.input.get_page(n)
+    if image:
+      image.save('page_r.png', 'PNG')
+      self.put(['page_r.png'], n, *self.key)
+      os.remove('page_r.png')
+
+    return image
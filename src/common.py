@@ -18,19 +18,36 @@
 ## FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 ## DEALINGS IN THE SOFTWARE.
 
-import os, sys, shutil, subprocess, Image, ImageFilter
+import os, re, sys, shutil, threading, subprocess, StringIO, Image, ImageFilter
+
+from multiprocessing.pool import ThreadPool
 
 ########################################################### CONSTANTS
 
 DEFAULT_PROFILE       = 'reb1100'
 DEFAULT_INPUT_FORMAT  = 'pdf'
 DEFAULT_DPI           = 300
+AUTO_DPI_CONTENT      = 0.8
+AUTO_DPI_RANGE        = (50, 600)
+DEFAULT_DILATION      = 3
 DEFAULT_EDGE_ENHANCE  = 5
 DEFAULT_CROP_PERCENT  = 2.0
 DEFAULT_COLORSPACE    = 'gray'
 DEFAULT_OVERLAP_H     = 20
 DEFAULT_OVERLAP_V     = 20
+DEFAULT_JOBS          = 1
+DEFAULT_CHUNK_SIZE    = 1
+DEFAULT_READ_QUEUE    = 2
+DEFAULT_CACHE_SIZE    = 1024
+DEFAULT_RASTER_CACHE  = 4096
+DEFAULT_IMAGE_CACHE   = 2
+DEFAULT_ENGINE        = 'pil'
+DEFAULT_QUANTIZER     = 'internal'
+DEFAULT_DITHER        = 'none'
+DEFAULT_OPTIMIZER     = 'optipng'
 IMAGENAME_SPEC        = '%d.png'
+PNM_HEADER            = re.compile(r'P([56])(?:\s|#.*\n)+(\d+)(?:\s|#.*\n)+'
+                                   r'(\d+)(?:\s|#.*\n)+(\d+)\s')
 
 ########################################################### COMMANDS
 
@@ -41,8 +58,7 @@ COMMANDS = {
   'pngnq'     : False,
   'pdfinfo'   : False,
   'djvused'   : False,
-  'tiffcp'    : False,
-  'tiffsplit' : False
+  'tiffcp'    : False
 }
 
 ########################################################### PROFILES
@@ -91,6 +107,11 @@ class EdgeEnhanceFilter(ImageFilter.Kernel):
 
 """ superclass for all input formats """
 class BaseInput(object):
+  chunk_size = 1
+
+  ## whether the pages are rendered, rather than read from image files, so
+  ## that keeping them in the raster cache pays off
+  rasterizes = False
 
   """ ignore all keyword arguments """
   def __init__(self, **args):
@@ -103,24 +124,43 @@ class BaseMode(object):
   def __init__(self, hres, vres, **args):
     self.hres, self.vres = hres, vres
 
+  """ the raster size needed for full detail, as (width, height); reaching
+      either one is enough, and None leaves that axis unconstrained """
+  def required_size(self):
+    return self.hres, self.vres
+
 """ superclass for all output generators """
 class BaseOutput(object):
+  ## whether the book can be built from images handed over in memory
+  in_memory = False
 
   """ initalise """
   def __init__(self, output, optimize, colors, no_enhance,
-               edge_level, title, author, category, **args):
+               edge_level, title, author, category, output_dir='.',
+               quantizer=DEFAULT_QUANTIZER,
+               dither=DEFAULT_DITHER, optimizer=DEFAULT_OPTIMIZER,
+               jobs=DEFAULT_JOBS, cache=None, **args):
     self.n       = 0
     self.toc_map = {}
     self.edge    = None
+    self.dir     = output_dir
+    self.quantizer, self.dither = quantizer, dither
+    self.optimizer, self.jobs   = optimizer, jobs
+    self.pool, self.pending     = None, {}
+
+    # the page cache and the optimizers still need the images as files
+    self.in_memory = self.in_memory and not cache and not optimize
 
     self.colors, self.optimize, self.output = colors, optimize, output
     self.title, self.author, self.category  = title, author, category
     if not no_enhance and edge_level in range(1,10):
       self.edge = edge_level
 
+  """ save the images of a page, returning the files generated """
   def add_page(self, page, images):
     p('SAVE ')
     self.toc_map[page] = self.n
+    files = []
     for image in images:
       if self.edge:
         image = image.filter( EdgeEnhanceFilter(self.edge) )
@@ -129,23 +169,102 @@ class BaseOutput(object):
       if sum(hist[:32]) < 10 or sum(hist[224:]) < 10:
         continue
 
-      filename = IMAGENAME_SPEC % self.n
-      if self.colors <= 2:
-        image.save(filename)
-      else:
-        self.downsample(image, filename)
+      if self.in_memory:
+        data = StringIO.StringIO()
+        self.encode(image, data)
+        if data.tell():
+          self.add_image(data.getvalue())
+          self.n += 1
+        continue
 
-      if self.optimize:
-        call('optipng', filename)
+      filename = os.path.join(self.dir, IMAGENAME_SPEC % self.n)
+      self.encode(image, filename)
 
       if os.path.exists(filename):
+        if self.optimize:
+          self.optimize_file(filename)
+        files.append(filename)
         self.n += 1
 
-  def downsample(self, image, filename):
-    image.save('page.png')
-    call('pngnq', '-fs', '1', '-n', str(self.colors), 'page.png')
-    if os.path.exists('page-nq8.png'):
-      os.rename('page-nq8.png', filename)
+    return files
+
+  """ take the encoded PNG data of the next image; outputs which can embed
+      it without a file of its own override this, the others get the file """
+  def add_image(self, data):
+    f = open(os.path.join(self.dir, IMAGENAME_SPEC % self.n), 'wb')
+    f.write(data)
+    f.close()
+
+  """ optimize a generated image in the background, while the following
+      pages are processed """
+  def optimize_file(self, filename):
+    if self.pool is None:
+      self.pool = ThreadPool(max(1, self.jobs))
+
+    filename = os.path.abspath(filename)
+    if self.optimizer == 'internal':
+      from quantize import optimize_png
+      result = self.pool.apply_async(optimize_png, (filename,))
+    else:
+      result = self.pool.apply_async(call, ('optipng', filename))
+    self.pending[filename] = result
+
+  """ whether the optimization of every one of some files has succeeded """
+  def optimized(self, files):
+    for name in files:
+      result = self.pending.get(os.path.abspath(name))
+      if result is not None and not (result.ready() and result.successful()):
+        return False
+    return True
+
+  """ wait until every pending optimization has finished """
+  def flush(self):
+    pending, self.pending = self.pending, {}
+    for result in pending.values():
+      result.get()
+
+    if self.pool is not None:
+      self.pool.close()
+      self.pool.join()
+      self.pool = None
+
+  """ add a page from previously generated files """
+  def add_cached_page(self, page, files):
+    self.toc_map[page] = self.n
+    for name in files:
+      shutil.copyfile(name, os.path.join(self.dir, IMAGENAME_SPEC % self.n))
+      self.n += 1
+
+  """ write an image as a PNG, to a file name or a file object """
+  def encode(self, image, target):
+    if self.colors < 2:
+      image.save(target, 'PNG')
+    else:
+      self.downsample(image, target)
+
+  """ reduce an image to the device colors, packing gray levels into as
+      few bits per pixel as they need """
+  def downsample(self, image, target):
+    if self.quantizer == 'internal' and (image.mode == 'L' or self.colors == 2):
+      from quantize import quantize, write_gray_png
+      write_gray_png(target, quantize(image, self.colors, self.dither),
+                     self.colors)
+      return
+
+    if self.colors == 2:
+      image.save(target, 'PNG')
+      return
+
+    image.save('page_q.png')
+    call('pngnq', '-fs', '1', '-n', str(self.colors), 'page_q.png')
+    if not os.path.exists('page_q-nq8.png'):
+      return
+
+    if hasattr(target, 'write'):
+      target.write(read_file('page_q-nq8.png'))
+      os.remove('page_q-nq8.png')
+    else:
+      os.rename('page_q-nq8.png', target)
 
   def move_output(self, ext):
     fname = self.output
@@ -187,11 +306,59 @@ def call(*args):
   process.wait()
   return data
 
+""" convert images to a picklable form, for passing between processes """
+def pack_images(images):
+  return [ (image.mode, image.size, image.tostring()) for image in images ]
+
+def unpack_images(data):
+  return [ Image.fromstring(mode, size, raw) for mode, size, raw in data ]
+
+""" run a command, returning only what it writes to standard output """
+def pipe(*args):
+  null    = open(os.devnull, 'wb')
+  process = subprocess.Popen(list(args),
+                             stdin  = subprocess.PIPE,
+                             stdout = subprocess.PIPE,
+                             stderr = null)
+  process.stdin.close()
+  data = process.stdout.read()
+  process.wait()
+  null.close()
+  return data
+
+""" build images straight from a stream of binary PGM/PPM data """
+def parse_pnm(data):
+  images = []
+  offset = 0
+  while True:
+    match = PNM_HEADER.match(data, offset)
+    if not match or int(match.group(4)) > 255:
+      return images
+
+    mode   = match.group(1) == '5' and 'L' or 'RGB'
+    size   = int(match.group(2)), int(match.group(3))
+    offset = match.end()
+    length = size[0] * size[1] * len(mode)
+    if len(data) < offset + length:
+      return images
+
+    images.append( Image.frombuffer(mode, size, buffer(data, offset, length),
+                                    'raw', mode, 0, 1) )
+    offset += length
+
 P_STREAM = sys.stdout
+P_THREAD = threading.local()
 def p(str, *args):
+  if getattr(P_THREAD, 'silent', False):
+    return
+
   P_STREAM.write(str % tuple(args))
   P_STREAM.flush()
 
+""" suppress progress output from the current thread """
+def silence():
+  P_THREAD.silent = True
+
 def check_commands():
   for command in COMMANDS.keys():
     try:
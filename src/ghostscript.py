@@ -0,0 +1,193 @@
+## Copyright (c) 2007 Ashish Kulkarni
+##
+## Permission is hereby granted, free of charge, to any person obtaining a
+## copy of this software and associated documentation files (the "Software"),
+## to deal in the Software without restriction, including without limitation
+## the rights to use, copy, modify, merge, publish, distribute, sublicense,
+## and/or sell copies of the Software, and to permit persons to whom the
+## Software is furnished to do so, subject to the following conditions:
+##
+## The above copyright notice and this permission notice shall be included in
+## all copies or substantial portions of the Software.
+##
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+## IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+## FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+## AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+## LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+## FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+## DEALINGS IN THE SOFTWARE.
+
+
+import sys, atexit, ctypes, ctypes.util, Image
+
+########################################################### CONSTANTS
+
+LIBRARIES = {
+  'win32'  : ['gsdll32.dll', 'gsdll64.dll'],
+  'darwin' : ['libgs.dylib'],
+}
+DEFAULT_LIBRARIES = ['libgs.so', 'libgs.so.10', 'libgs.so.9', 'libgs.so.8']
+
+## from gdevdsp.h: 8 bits per component, top row first, no alpha
+DISPLAY_FORMAT = { 'L' : 0x0802, 'RGB' : 0x0804 }
+
+if sys.platform == 'win32':
+  FUNCTYPE = ctypes.WINFUNCTYPE
+else:
+  FUNCTYPE = ctypes.CFUNCTYPE
+
+STDIO_FN   = FUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int)
+DISPLAY_FN = FUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+PRESIZE_FN = FUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p,
+                      ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_uint)
+SIZE_FN    = FUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p,
+                      ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_uint,
+                      ctypes.c_void_p)
+PAGE_FN    = FUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p,
+                      ctypes.c_int, ctypes.c_int)
+UPDATE_FN  = FUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p,
+                      ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int)
+
+""" the display device callback table (version 2.0) """
+class DisplayCallback(ctypes.Structure):
+  _fields_ = [('size',               ctypes.c_int),
+              ('version_major',      ctypes.c_int),
+              ('version_minor',      ctypes.c_int),
+              ('display_open',       DISPLAY_FN),
+              ('display_preclose',   DISPLAY_FN),
+              ('display_close',      DISPLAY_FN),
+              ('display_presize',    PRESIZE_FN),
+              ('display_size',       SIZE_FN),
+              ('display_sync',       DISPLAY_FN),
+              ('display_page',       PAGE_FN),
+              ('display_update',     UPDATE_FN),
+              ('display_memalloc',   ctypes.c_void_p),
+              ('display_memfree',    ctypes.c_void_p),
+              ('display_separation', ctypes.c_void_p)]
+
+########################################################### METHODS
+
+""" load the Ghostscript shared library, or return None if not present """
+def load_library():
+  loader = ctypes.cdll
+  if sys.platform == 'win32':
+    loader = ctypes.windll
+
+  names = LIBRARIES.get(sys.platform, DEFAULT_LIBRARIES)
+  found = ctypes.util.find_library('gs')
+  if found:
+    names = [found] + names
+
+  for name in names:
+    try:
+      return loader.LoadLibrary(name)
+    except OSError:
+      pass
+
+  return None
+
+""" quote a string for use in PostScript """
+def ps_string(text):
+  return '(%s)' % text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+###################################################### RENDERER
+
+""" error raised when the interpreter cannot be used """
+class GhostscriptError(Exception):
+  pass
+
+""" a resident Ghostscript interpreter which renders PDF pages to memory """
+class PdfRenderer(object):
+
+  """ initialise the interpreter and open the document """
+  def __init__(self, input, dpi, mode, args=()):
+    self.lib = load_library()
+    if self.lib is None or not hasattr(self.lib, 'gsapi_set_display_callback'):
+      raise GhostscriptError('Ghostscript library not found')
+
+    self.mode, self.image, self.frame = mode, None, None
+    self.instance = ctypes.c_void_p()
+    if self.lib.gsapi_new_instance(ctypes.byref(self.instance), None) < 0:
+      raise GhostscriptError('unable to create Ghostscript instance')
+
+    # keep references to the callbacks, they must outlive the interpreter
+    self.stdio = (STDIO_FN(self.on_stdin), STDIO_FN(self.on_output),
+                  STDIO_FN(self.on_output))
+    self.callback = DisplayCallback(ctypes.sizeof(DisplayCallback), 2, 0,
+                                    DISPLAY_FN(self.on_event),
+                                    DISPLAY_FN(self.on_event),
+                                    DISPLAY_FN(self.on_event),
+                                    PRESIZE_FN(self.on_presize),
+                                    SIZE_FN(self.on_size),
+                                    DISPLAY_FN(self.on_event),
+                                    PAGE_FN(self.on_page),
+                                    UPDATE_FN(self.on_update),
+                                    None, None, None)
+
+    self.lib.gsapi_set_stdio(self.instance, *self.stdio)
+    self.lib.gsapi_set_display_callback(self.instance, ctypes.byref(self.callback))
+
+    argv = ['pdfread', '-q', '-dNOPAUSE', '-dSAFER',
+            '--permit-file-read=%s' % input, '-r%d' % dpi,
+            '-sDEVICE=display', '-dDisplayFormat=%d' % DISPLAY_FORMAT[mode],
+            '-dDisplayHandle=0'] + list(args)
+    if self.lib.gsapi_init_with_args(self.instance, len(argv),
+                                     (ctypes.c_char_p * len(argv))(*argv)) < 0:
+      self.close()
+      raise GhostscriptError('unable to initialise Ghostscript')
+
+    atexit.register(self.close)
+    if self.run('%s (r) file runpdfbegin' % ps_string(input)) < 0:
+      self.close()
+      raise GhostscriptError('unable to open document')
+
+  """ execute some PostScript in the interpreter """
+  def run(self, code):
+    exit_code = ctypes.c_int()
+    return self.lib.gsapi_run_string(self.instance, code, 0,
+                                     ctypes.byref(exit_code))
+
+  """ render a single page, returning it as an image """
+  def render(self, n):
+    self.image = None
+    if self.run('%d pdfgetpage pdfshowpage' % n) < 0:
+      return None
+
+    image, self.image = self.image, None
+    return image
+
+  """ shut down the interpreter """
+  def close(self):
+    if self.instance:
+      self.lib.gsapi_exit(self.instance)
+      self.lib.gsapi_delete_instance(self.instance)
+      self.instance = None
+
+  ###################################################### CALLBACKS
+
+  def on_stdin(self, handle, buffer, length):
+    return 0
+
+  def on_output(self, handle, buffer, length):
+    return length
+
+  def on_event(self, handle, device):
+    return 0
+
+  def on_update(self, handle, device, x, y, w, h):
+    return 0
+
+  def on_presize(self, handle, device, width, height, raster, format):
+    return 0
+
+  def on_size(self, handle, device, width, height, raster, format, pimage):
+    self.frame = (width, height, raster, pimage)
+    return 0
+
+  def on_page(self, handle, device, copies, flush):
+    width, height, raster, pimage = self.frame
+    data = ctypes.string_at(pimage, raster * height)
+    self.image = Image.frombuffer(self.mode, (width, height), data,
+                                  'raw', self.mode, raster, 1)
+    return 0
@@ -19,7 +19,7 @@
 ## DEALINGS IN THE SOFTWARE.
 
 
-import os, re, glob, Image
+import os, re, sys, glob, struct, Image
 from common import *
 
 ########################################################### PDF INPUT
@@ -29,94 +29,303 @@ PDFTK_COUNT   = re.compile(r'NumberOfPages: (\d+)')
 PDFTK_TOC     = re.compile(r'BookmarkTitle:\s+(.*)\s+BookmarkLevel:\s+(\d+)\s+BookmarkPageNumber:\s+(\d+)')
 PDFINFO_COUNT = re.compile(r'Pages:\s+(\d+)')
 PDF_DEVICE    = { 'gray' : 'pnggray', 'rgb' : 'png16m' }
+PDF_PIPE      = { 'gray' : 'pgmraw',  'rgb' : 'ppmraw' }
+PDF_CHUNK     = 'page%05d.png'
+GS_OPTIONS    = ['-dDOINTERPOLATE', '-dTextAlphaBits=4', '-dGraphicsAlphaBits=4',
+                 '-dUseCropBox']
+
+## the pre-pass which finds the inked region of the pages
+PREPASS_DPI   = 24
+PREPASS_CHUNK = 50
+PREPASS_INK   = 224
+PREPASS_PAD   = 2
 
 """ support for the PDF format """
 class PdfInput(BaseInput):
   __plugin__ = 'pdf'
+  rasterizes = True
 
   """ initalise """
-  def __init__(self, input, dpi, colorspace, no_toc, **args):
-    self.input, self.dpi = input, dpi
-    self.get_meta_info(no_toc)
-    self.device = '-sDEVICE=%s' % PDF_DEVICE[colorspace]
+  def __init__(self, input, dpi, colorspace, no_toc, chunk_size=1,
+               first_page=None, last_page=None, pipe=False, libgs=False,
+               count=None, extract_images=False, render_region=False, **args):
+    self.input, self.dpi, self.pipe = input, dpi, pipe
+    self.get_meta_info(no_toc, count)
+    self.device = '-sDEVICE=%s' % (pipe and PDF_PIPE or PDF_DEVICE)[colorspace]
+    self.immode = COLORSPACE[colorspace]
+    self.libgs, self.renderer = libgs, None
+    self.chunk_size, self.chunk = max(1, chunk_size), None
+    self.first_page = max(1, first_page or 1)
+    self.last_page = min(last_page or self.count, self.count)
+    self.extract_images, self.document = extract_images, None
+    self.render_region, self.regions = render_region, None
+    self.full_pages = {}
 
   """ get meta information from the PDF file """
-  def get_meta_info(self, no_toc=False):
-    self.count   = 0
+  def get_meta_info(self, no_toc=False, count=None):
+    self.count   = count or 0
     self.toc     = []
     self.toc_map = {}
 
+    if self.read_structure(no_toc):
+      return
+
     if COMMANDS['pdftk']:
       data = call('pdftk', self.input, 'dump_data', 'output', '-')
 
       match = PDFTK_COUNT.search(data)
-      if match:
+      if match and not self.count:
         self.count = int(match.group(1))
 
       if not no_toc:
         self.toc = PDFTK_TOC.findall(data)
 
-    elif COMMANDS['pdfinfo']:
+    elif COMMANDS['pdfinfo'] and not self.count:
       data  = call('pdfinfo', self.input)
 
       match = PDFINFO_COUNT.search(data)
       if match:
         self.count = int(match.group(1))
 
-    # if nothing found, ask the user for the information
-    if not self.count:
-      p('Unable to determine total number of pages in document\n')
-      self.count = int(raw_input('Please enter number of pages: '))
+  """ read the page count and outline directly from the PDF file """
+  def read_structure(self, no_toc):
+    from pdfdoc import PdfDocument
+    try:
+      document = PdfDocument(self.input)
+      try:
+        if not self.count:
+          self.count = document.page_count()
+        # the titles of an encrypted document cannot be decrypted here,
+        # leave the outline to the external programs
+        if document.encrypted and not no_toc:
+          return False
+        if not no_toc:
+          self.toc = document.outlines()
+      finally:
+        document.close()
+    except Exception, e:
+      p('Unable to read document structure (%s)\n', e)
+      return False
+
+    return True
+
+
+  """ rasterize a range of pages from the PDF file """
+  def rasterize(self, first, last, output):
+    p('RASTERIZE ')
+    args = self.gs_args(first, last, self.dpi, self.device, output,
+                        self.get_region(first, last))
+    return (self.pipe and pipe or call)(*args)
+
+  """ the Ghostscript command line rendering a range of pages, optionally
+      restricted to a region given in points from the bottom left """
+  def gs_args(self, first, last, dpi, device, output, region=None):
+    args = ['gs', '-q', '-dBATCH', '-dSAFER', '-dNOPAUSE'] + GS_OPTIONS + \
+           ['-r%d' % dpi, '-dFirstPage=%d' % first, '-dLastPage=%d' % last,
+            device, '-sOutputFile=%s' % output]
+
+    if region is not None:
+      # shrink the device to the region and shift the region onto it
+      x0, y0, x1, y1 = region
+      args += ['-dFIXEDMEDIA', '-dDEVICEWIDTHPOINTS=%.2f' % (x1 - x0),
+               '-dDEVICEHEIGHTPOINTS=%.2f' % (y1 - y0), '-c',
+               '<</PageOffset [%.2f %.2f]>> setpagedevice' % (-x0, -y0), '-f']
+
+    return args + [self.input]
+
+  """ find the inked region of the pages with a quick low resolution pass,
+      keeping one box for the odd and one for the even pages """
+  def find_regions(self):
+    self.regions = {}
+    scale = 72.0 / PREPASS_DPI
+    for first in range(self.first_page, self.last_page + 1, PREPASS_CHUNK):
+      last   = min(first + PREPASS_CHUNK - 1, self.last_page)
+      images = parse_pnm(pipe(*self.gs_args(first, last, PREPASS_DPI,
+                                             '-sDEVICE=pgmraw', '-')))
+
+      # with a page missing the images cannot be matched to their pages,
+      # so the pages of the range are rendered whole
+      if len(images) != last - first + 1:
+        for n in range(first, last + 1):
+          self.full_pages[n] = True
+        continue
 
+      for n, image in zip(range(first, last + 1), images):
+        box = image.point(lambda v: v < PREPASS_INK and 255 or 0).getbbox()
+        if box is None:
+          continue
+
+        w, h = image.size
+        l, t = max(0, box[0] - PREPASS_PAD), max(0, box[1] - PREPASS_PAD)
+        r, b = min(w, box[2] + PREPASS_PAD), min(h, box[3] + PREPASS_PAD)
+        self.add_region(n % 2, (l*scale, (h-b)*scale, r*scale, (h-t)*scale))
+
+  """ extend the region kept for a parity to include a box """
+  def add_region(self, parity, box):
+    region = self.regions.get(parity, box)
+    self.regions[parity] = (min(region[0], box[0]), min(region[1], box[1]),
+                            max(region[2], box[2]), max(region[3], box[3]))
+
+  """ the region to render for a range of pages, or None for all of it """
+  def get_region(self, first, last):
+    if not self.render_region:
+      return None
+
+    if self.regions is None:
+      self.find_regions()
+
+    for n in range(first, last + 1):
+      if self.full_pages.has_key(n):
+        return None
+
+    # a range of more than one page needs the boxes of both parities
+    boxes = [ self.regions[n % 2] for n in range(first, min(last, first+1) + 1)
+              if self.regions.has_key(n % 2) ]
+    if not boxes:
+      return None
+
+    return (min([ box[0] for box in boxes ]), min([ box[1] for box in boxes ]),
+            max([ box[2] for box in boxes ]), max([ box[3] for box in boxes ]))
 
   """ get a page from the PDF file """
   def get_page(self, n):
+    if self.extract_images:
+      image = self.get_embedded_page(n)
+      if image:
+        return image
 
-    p('RASTERIZE ')
-    call('gs', '-q', '-dBATCH', '-dSAFER', '-dNOPAUSE', '-dDOINTERPOLATE',
-         '-dTextAlphaBits=4', '-dGraphicsAlphaBits=4', '-dUseCropBox',
-         '-r%d' % self.dpi, '-dFirstPage=%d' % n, '-dLastPage=%d' % n,
-         self.device, '-sOutputFile=page.png', self.input)
+    if self.libgs:
+      return self.get_libgs_page(n)
+
+    if self.chunk_size > 1:
+      return self.get_chunk_page(n)
+
+    if self.pipe:
+      images = parse_pnm(self.rasterize(n, n, '-'))
+      return images and images[0] or None
+
+    self.rasterize(n, n, 'page.png')
 
     if not os.path.exists('page.png'):
       return None
 
     return Image.open('page.png')
 
+  """ get the single embedded image of a scanned page, at its own
+      resolution, or None if the page has to be rasterized """
+  def get_embedded_page(self, n):
+    if self.document is None:
+      from pdfdoc import PdfDocument
+      try:
+        self.document = PdfDocument(self.input)
+      except Exception:
+        self.extract_images = False
+        return None
+
+    try:
+      image = self.document.page_image(n)
+    except Exception:
+      image = None
+
+    if image is None:
+      return None
+
+    p('EXTRACT ')
+    return image.convert(self.immode)
+
+  """ get a page from a resident Ghostscript interpreter """
+  def get_libgs_page(self, n):
+    from ghostscript import PdfRenderer, GhostscriptError
+    try:
+      if self.renderer is None:
+        self.renderer = PdfRenderer(self.input, self.dpi, self.immode,
+                                    GS_OPTIONS)
+
+      image = self.renderer.render(n)
+      if image is None:
+        raise GhostscriptError('unable to render page %d' % n)
+    except GhostscriptError, e:
+      # this runs in the reader thread, whose progress output is silenced
+      sys.stderr.write('libgs: %s, using the gs command from now on\n' % e)
+      sys.stderr.flush()
+      if self.renderer is not None:
+        self.renderer.close()
+      self.libgs, self.renderer = False, None
+      return self.get_page(n)
+
+    p('RASTERIZE ')
+    return image
+
+  """ get a page from the PDF file, rasterizing the following pages too """
+  def get_chunk_page(self, n):
+    if not self.chunk or not self.chunk[0] <= n <= self.chunk[1]:
+      rm(*glob.glob('page[0-9]*.png'))
+      self.chunk = (n, max(n, min(n + self.chunk_size - 1, self.last_page)))
+
+      if self.pipe:
+        images = parse_pnm(self.rasterize(self.chunk[0], self.chunk[1], '-'))
+        self.images = dict(zip(range(n, n + len(images)), images))
+      else:
+        self.rasterize(self.chunk[0], self.chunk[1], PDF_CHUNK)
+
+    if self.pipe:
+      return self.images.pop(n, None)
+
+    filename = PDF_CHUNK % (n - self.chunk[0] + 1)
+    if not os.path.exists(filename):
+      return None
+
+    image = Image.open(filename)
+    image.load()
+    os.remove(filename)
+    return image
+
 
 ########################################################## DJVU INPUT
 
 DJVU_MODE = { 'gray' : 'black', 'rgb' : 'color' }
+DJVU_PIPE = { 'gray' : 'pgm',   'rgb' : 'ppm' }
+DJVU_CHUNK = 'chunk.tif'
 
 """ support for the DJVU format """
 class DjvuInput(BaseInput):
   __plugin__ = 'djvu'
+  rasterizes = True
 
   """ initalise """
-  def __init__(self, input, dpi, colorspace, **args):
-    self.input, self.dpi = input, dpi
-    self.get_meta_info()
+  def __init__(self, input, dpi, colorspace, chunk_size=1, last_page=None,
+               pipe=False, count=None, **args):
+    self.input, self.dpi, self.pipe = input, dpi, pipe
+    self.get_meta_info(count)
     self.mode   = '-mode=%s' % DJVU_MODE[colorspace]
+    self.format = '-format=%s' % DJVU_PIPE[colorspace]
     self.immode = COLORSPACE[colorspace]
+    self.chunk_size, self.chunk = max(1, chunk_size), None
+    self.last_page = min(last_page or self.count, self.count)
 
   """ get meta information from the document """
-  def get_meta_info(self):
-    self.count   = 0
+  def get_meta_info(self, count=None):
+    self.count   = count or 0
     self.toc     = []
     self.toc_map = {}
 
-    if COMMANDS['djvused']:
-      self.count = int(call('djvused', '-e', 'n', self.input))
-
-    # if nothing found, ask the user for the information
-    if not self.count:
-      p('Unable to determine total number of pages in document\n')
-      self.count = int(raw_input('Please enter number of pages: '))
-
+    if COMMANDS['djvused'] and not self.count:
+      try:
+        self.count = int(call('djvused', '-e', 'n', self.input))
+      except ValueError:
+        pass
 
   """ get a page from the document """
   def get_page(self, n):
 
+    if self.chunk_size > 1:
+      return self.get_chunk_page(n)
+
+    if self.pipe:
+      images = parse_pnm(pipe('ddjvu', self.mode, self.format, '-page', str(n),
+                              '-scale', str(self.dpi), self.input))
+      return images and images[0].convert(self.immode) or None
+
     call('ddjvu', self.mode, '-page', str(n), '-scale', str(self.dpi),
          self.input, 'page.pnm')
 
@@ -125,43 +334,113 @@ class DjvuInput(BaseInput):
 
     return Image.open('page.pnm').convert(self.immode)
 
+  """ get a page from the document, rendering the following pages too """
+  def get_chunk_page(self, n):
+    if not self.chunk or not self.chunk[0] <= n <= self.chunk[1]:
+      self.images = None
+      rm(DJVU_CHUNK)
+      self.chunk = (n, max(n, min(n + self.chunk_size - 1, self.last_page)))
+
+      # a single ddjvu run decodes the shared dictionaries once per chunk
+      call('ddjvu', self.mode, '-format=tiff', '-page=%d-%d' % self.chunk,
+           '-scale', str(self.dpi), self.input, DJVU_CHUNK)
+
+      if os.path.exists(DJVU_CHUNK):
+        self.images = Image.open(DJVU_CHUNK)
+
+    if self.images is None:
+      return None
+
+    try:
+      self.images.seek(n - self.chunk[0])
+      return self.images.convert(self.immode)
+    except EOFError:
+      return None
+
 ########################################################## TIFF INPUT
 
 
+""" count the pages of a TIFF file by walking its chain of directories """
+def tiff_page_count(name):
+  f = open(name, 'rb')
+  try:
+    header = f.read(8)
+    order  = { 'II' : '<', 'MM' : '>' }.get(header[:2])
+    if order is None or len(header) < 8:
+      return 0
+
+    version, = struct.unpack(order + 'H', header[2:4])
+    if version == 43:
+      # BigTIFF: 64-bit offsets and counts, 20 byte entries
+      f.seek(8)
+      offset, = struct.unpack(order + 'Q', f.read(8))
+      count_fmt, entry_size, offset_fmt = 'Q', 20, 'Q'
+    else:
+      offset, = struct.unpack(order + 'I', header[4:8])
+      count_fmt, entry_size, offset_fmt = 'H', 12, 'I'
+
+    count_size  = struct.calcsize(count_fmt)
+    offset_size = struct.calcsize(offset_fmt)
+
+    pages, seen = 0, {}
+    while offset and offset not in seen:
+      seen[offset] = True
+      f.seek(offset)
+      data = f.read(count_size)
+      if len(data) < count_size:
+        break
+
+      entries, = struct.unpack(order + count_fmt, data)
+      f.seek(offset + count_size + entries * entry_size)
+      data = f.read(offset_size)
+      pages += 1
+      if len(data) < offset_size:
+        break
+
+      offset, = struct.unpack(order + offset_fmt, data)
+
+    return pages
+  finally:
+    f.close()
+
 """ support for the TIFF format """
 class TiffInput(BaseInput):
   __plugin__ = 'tiff'
 
   """ initalise """
-  def __init__(self, input, dpi, colorspace, tempdir, **args):
+  def __init__(self, input, dpi, colorspace, **args):
     self.input, self.dpi = input, dpi
-    self.get_meta_info(tempdir)
+    self.get_meta_info()
     self.immode = COLORSPACE[colorspace]
+    self.image  = None
 
   """ get meta information from the document """
-  def get_meta_info(self, tempdir):
+  def get_meta_info(self):
     self.toc     = []
     self.toc_map = {}
-
-    p('\nExtracting TIFF pages ... ')
-    call('tiffcp', '-c', 'lzw', self.input,
-          os.path.join(tempdir, 'page.tif'))
-
-    call('tiffsplit', os.path.join(tempdir, 'page.tif'),
-          os.path.join(tempdir, 'page_'))
-    p('done.\n')
-
-    self.files = glob.glob(os.path.join(tempdir, 'page_*.tif'))
-    self.files.sort()
-    self.count = len(self.files)
-
+    self.count   = tiff_page_count(self.input)
 
   """ get a page from the document """
   def get_page(self, n):
     if n < 1 or n > self.count:
       return None
 
-    return Image.open(self.files[n-1]).convert(self.immode)
+    try:
+      # seek directly to the directory of the page
+      if self.image is None:
+        self.image = Image.open(self.input)
+      self.image.seek(n-1)
+      return self.image.convert(self.immode)
+    except:
+      self.image = None
+
+    # fall back to extracting the single page, for what PIL cannot decode
+    rm('page.tif')
+    call('tiffcp', '%s,%d' % (self.input, n-1), 'page.tif')
+    if not os.path.exists('page.tif'):
+      return None
+
+    return Image.open('page.tif').convert(self.immode)
 
 
 ########################################################## LIST INPUT
@@ -172,18 +451,20 @@ class ImageListInput(BaseInput):
   __plugin__ = 'imglist'
 
   """ initalise """
-  def __init__(self, input, colorspace, **args):
+  def __init__(self, input, colorspace, image_cache=DEFAULT_IMAGE_CACHE, **args):
     self.input = input
     self.immode = COLORSPACE[colorspace]
+    self.image_cache = image_cache
+    self.decoded = []
     self.load_images()
 
-  """ load the images from the list """
+  """ validate the images from the list, without decoding them """
   def load_images(self):
     self.toc     = []
     self.toc_map = {}
     self.files   = []
 
-    p('\nLoading images ... ')
+    p('\nChecking images ... ')
     list = file(self.input, 'r')
     for name in list.readlines():
       if not name.strip():
@@ -191,17 +472,34 @@ class ImageListInput(BaseInput):
       filename = os.path.abspath(name.strip())
       if filename and os.path.exists(filename):
         try:
-          image = Image.open(filename).convert(self.immode)
-          self.files.append(image)
+          # opening only reads the header, the pixels are decoded on demand
+          Image.open(filename)
+          self.files.append(filename)
         except:
           pass
     self.count = len(self.files)
 
-    p('%d loaded.\n' % self.count)
+    p('%d found.\n' % self.count)
 
   """ get a page from the document """
   def get_page(self, n):
     if n < 1 or n > self.count:
       return None
 
-    return self.files[n-1]
+    for entry in self.decoded:
+      if entry[0] == n:
+        # mark the image as the most recently used
+        self.decoded.remove(entry)
+        self.decoded.append(entry)
+        return entry[1]
+
+    try:
+      image = Image.open(self.files[n-1]).convert(self.immode)
+    except:
+      return None
+
+    if self.image_cache > 0:
+      self.decoded.append( (n, image) )
+      del self.decoded[:-self.image_cache]
+
+    return image
@@ -0,0 +1,58 @@
+## Copyright (c) 2007 Ashish Kulkarni
+##
+## Permission is hereby granted, free of charge, to any person obtaining a
+## copy of this software and associated documentation files (the "Software"),
+## to deal in the Software without restriction, including without limitation
+## the rights to use, copy, modify, merge, publish, distribute, sublicense,
+## and/or sell copies of the Software, and to permit persons to whom the
+## Software is furnished to do so, subject to the following conditions:
+##
+## The above copyright notice and this permission notice shall be included in
+## all copies or substantial portions of the Software.
+##
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+## IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+## FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+## AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+## LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+## FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+## DEALINGS IN THE SOFTWARE.
+
+
+import numpy, Image
+
+########################################################### CONVERSION
+
+""" the pixels of an image as an array of rows, with a band axis for RGB """
+def to_array(image):
+  w, h  = image.size
+  data  = numpy.fromstring(image.tostring(), numpy.uint8)
+  bands = len(image.getbands())
+  if bands == 1:
+    return data.reshape((h, w))
+  return data.reshape((h, w, bands))
+
+""" build an image from an array made by to_array """
+def from_array(data, mode):
+  return Image.fromstring(mode, (data.shape[1], data.shape[0]),
+                          numpy.ascontiguousarray(data).tostring())
+
+########################################################### FILTERS
+
+""" minimum filter, the same as ImageFilter.MinFilter(size): the edges are
+    replicated, so a pixel beyond the border never lowers the minimum """
+def min_filter(image, size=3):
+  data = to_array(image)
+
+  # the filter is separable, a minimum across the rows then down the columns
+  rows = data.copy()
+  for k in range(1, size // 2 + 1):
+    numpy.minimum(rows[:, k:],  data[:, :-k], rows[:, k:])
+    numpy.minimum(rows[:, :-k], data[:, k:],  rows[:, :-k])
+
+  output = rows.copy()
+  for k in range(1, size // 2 + 1):
+    numpy.minimum(output[k:],  rows[:-k], output[k:])
+    numpy.minimum(output[:-k], rows[k:],  output[:-k])
+
+  return from_array(output, image.mode)
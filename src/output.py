@@ -19,7 +19,7 @@
 ## DEALINGS IN THE SOFTWARE.
 
 
-import os, sys, traceback
+import os, sys, tempfile, traceback
 
 from common import *
 
@@ -60,6 +60,7 @@ class HtmlOutput(BaseOutput):
 
   """ generate an HTML file """
   def generate(self, toc):
+    self.flush()
     output = """
 <html>
  <head>
@@ -173,15 +174,55 @@ class HalfVgaImpOutput(ImpOutput):
 ########################################################## BBEB OUTPUT
 
 
+""" a part of a file, which can be read as a file of its own """
+class FileSlice(object):
+
+  """ initialise """
+  def __init__(self, file, offset, size):
+    self.file, self.offset, self.size, self.pos = file, offset, size, 0
+
+  def seek(self, pos, whence=0):
+    pos += (0, self.pos, self.size)[whence]
+    self.pos = max(0, min(pos, self.size))
+
+  def tell(self):
+    return self.pos
+
+  def read(self, size=-1):
+    if size < 0 or size > self.size - self.pos:
+      size = self.size - self.pos
+
+    self.file.seek(self.offset + self.pos)
+    data = self.file.read(size)
+    self.pos += len(data)
+    return data
+
 """ support for Sony BBeB output """
 class LrfOutput(BaseOutput):
   __plugin__ = 'lrf'
+  in_memory  = True
+
+  """ initialise """
+  def __init__(self, **args):
+    BaseOutput.__init__(self, **args)
+    self.spool, self.images = None, []
+
+  """ append the encoded image to a temporary spool file, keeping only where
+      it is, so that it can be embedded in the book without an image file """
+  def add_image(self, data):
+    if self.spool is None:
+      self.spool = tempfile.TemporaryFile(prefix='images', dir=self.dir)
+
+    self.spool.seek(0, 2)
+    self.images.append( (self.spool.tell(), len(data)) )
+    self.spool.write(data)
 
   """ generate a LRF file """
   def generate(self, toc):
     from pylrs.pylrs import Book, PageStyle, BlockStyle
     from pylrs.pylrs import ImageStream, BlockSpace, ImageBlock
 
+    self.flush()
     p('\nCreating BBeB file ... ')
 
     # create book instance
@@ -194,7 +235,12 @@ class LrfOutput(BaseOutput):
     # create pages
     images = []
     for i in range(self.n):
-      stream = ImageStream(IMAGENAME_SPEC % i)
+      if self.in_memory:
+        offset, size = self.images[i]
+        stream = ImageStream(FileSlice(self.spool, offset, size),
+                             encoding='PNG')
+      else:
+        stream = ImageStream(IMAGENAME_SPEC % i)
       page   = book.Page(pageStyle)
       page.BlockSpace()
       image  = page.ImageBlock(refstream=stream, xsize='565', ysize='754',
@@ -208,8 +254,11 @@ class LrfOutput(BaseOutput):
         imagenum = toc_map[int(page_)]
         book.addTocEntry(title.strip(), images[imagenum])
 
-    # generate the ebook
-    book.renderLrf("ebook.lrf")
+    # generate the ebook, writing out each page as soon as it is converted
+    book.renderLrf("ebook.lrf", incremental=True)
+    if self.spool is not None:
+      self.spool.close()
+      self.spool = None
 
     p('done.\n')
 
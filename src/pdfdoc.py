@@ -0,0 +1,843 @@
+## Copyright (c) 2007 Ashish Kulkarni
+##
+## Permission is hereby granted, free of charge, to any person obtaining a
+## copy of this software and associated documentation files (the "Software"),
+## to deal in the Software without restriction, including without limitation
+## the rights to use, copy, modify, merge, publish, distribute, sublicense,
+## and/or sell copies of the Software, and to permit persons to whom the
+## Software is furnished to do so, subject to the following conditions:
+##
+## The above copyright notice and this permission notice shall be included in
+## all copies or substantial portions of the Software.
+##
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+## IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+## FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+## AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+## LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+## FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+## DEALINGS IN THE SOFTWARE.
+
+
+import re, mmap, zlib, struct, binascii, StringIO, Image, ImageChops
+
+########################################################### CONSTANTS
+
+WHITESPACE = r'\x00\t\n\x0c\r '
+REGULAR    = r'[^\x00\t\n\x0c\r ()<>\[\]{}/%]'
+SKIP       = r'(?:[\x00\t\n\x0c\r ]|%[^\r\n]*)*'
+
+TOKEN      = re.compile(SKIP + r'(<<|>>|[\[\]{}()]|<[^<>]*>|/' + REGULAR + '*|' +
+                        REGULAR + '+)')
+REF_TAIL   = re.compile(SKIP + r'(\d+)' + SKIP + r'R(?!' + REGULAR + ')')
+NUMBER     = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)$')
+STRING     = re.compile(r'[()\\]')
+NAME_HEX   = re.compile(r'#([0-9A-Fa-f]{2})')
+STARTXREF  = re.compile(r'startxref\s+(\d+)')
+XREF_ENTRY = re.compile(r'\s*(\d{10})\s(\d{5})\s([nf])')
+OBJ_HEADER = re.compile(r'(?<!\d)(\d+)\s+(\d+)\s+obj\b')
+TRAILER    = re.compile(r'trailer\s*<<')
+
+ESCAPES    = { 'n' : '\n', 'r' : '\r', 't' : '\t', 'b' : '\b', 'f' : '\f' }
+
+## attributes a page inherits from the nodes of the page tree above it
+INHERITED  = ['Resources', 'MediaBox', 'CropBox', 'Rotate']
+
+## content stream operators which do not paint anything themselves
+STATE_OPS  = ['q', 'Q', 'cm', 'gs', 'w', 'J', 'j', 'M', 'd', 'ri', 'i',
+              'BMC', 'BDC', 'EMC', 'MP', 'DP']
+
+## filters which are decoded as images rather than as plain data
+IMAGE_FILTERS = ['DCTDecode', 'DCT', 'CCITTFaxDecode', 'CCF', 'JPXDecode']
+
+## the number of components of the colour spaces we can decode
+COMPONENTS = { 'DeviceGray' : 1, 'CalGray' : 1, 'G' : 1,
+               'DeviceRGB'  : 3, 'CalRGB'  : 3, 'RGB' : 3 }
+
+## the fraction of the page an image must cover to stand for the page
+MIN_COVERAGE = 0.5
+
+ROTATE = { 90 : Image.ROTATE_270, 180 : Image.ROTATE_180, 270 : Image.ROTATE_90 }
+
+########################################################### TYPES
+
+""" error raised for documents which cannot be read """
+class PdfError(Exception):
+  pass
+
+""" a PDF name, which is kept apart from strings """
+class Name(str):
+  pass
+
+""" a reference to an indirect object, as (number, generation) """
+class Ref(tuple):
+  pass
+
+""" a stream, with its dictionary and still encoded data """
+class Stream(object):
+
+  def __init__(self, dict, data):
+    self.dict, self.data = dict, data
+
+########################################################### PARSING
+
+""" get the next token and the position following it """
+def next_token(data, pos):
+  match = TOKEN.match(data, pos)
+  if not match:
+    raise PdfError('unexpected end of data at %d' % pos)
+  return match.group(1), match.end()
+
+""" parse a literal string, starting after its opening parenthesis """
+def parse_string(data, pos):
+  depth, output = 1, []
+  while True:
+    match = STRING.search(data, pos)
+    if not match:
+      raise PdfError('unterminated string')
+
+    output.append(data[pos:match.start()])
+    char, pos = match.group(), match.end()
+    if char == '(':
+      depth += 1
+      output.append(char)
+    elif char == ')':
+      depth -= 1
+      if not depth:
+        return ''.join(output), pos
+      output.append(char)
+    else:
+      char, pos = data[pos], pos + 1
+      if char in ESCAPES:
+        output.append(ESCAPES[char])
+      elif char in '01234567':
+        end = pos
+        while end < pos + 2 and data[end] in '01234567':
+          end += 1
+        output.append(chr(int(data[pos-1:end], 8) & 0xff))
+        pos = end
+      elif char == '\r':
+        if data[pos] == '\n':
+          pos += 1
+      elif char != '\n':
+        output.append(char)
+
+""" parse an object, returning it and the position following it """
+def parse_object(data, pos):
+  token, pos = next_token(data, pos)
+
+  if token == '<<':
+    dict = {}
+    while True:
+      key, pos = next_token(data, pos)
+      if key == '>>':
+        return dict, pos
+      if not key.startswith('/'):
+        raise PdfError('invalid dictionary key %r' % key)
+      dict[parse_name(key)], pos = parse_object(data, pos)
+
+  if token == '[':
+    array = []
+    while True:
+      match = TOKEN.match(data, pos)
+      if match and match.group(1) == ']':
+        return array, match.end()
+      value, pos = parse_object(data, pos)
+      array.append(value)
+
+  if token == '(':
+    return parse_string(data, pos)
+
+  if token.startswith('<'):
+    hex = re.sub('[%s]' % WHITESPACE, '', token[1:-1])
+    if len(hex) % 2:
+      hex += '0'
+    return binascii.unhexlify(hex), pos
+
+  if token.startswith('/'):
+    return parse_name(token), pos
+
+  if NUMBER.match(token):
+    if '.' in token:
+      return float(token), pos
+
+    # an integer may start a reference, 'N G R'
+    match = REF_TAIL.match(data, pos)
+    if match:
+      return Ref((int(token), int(match.group(1)))), match.end()
+    return int(token), pos
+
+  if token == 'true':
+    return True, pos
+  if token == 'false':
+    return False, pos
+  if token == 'null':
+    return None, pos
+
+  raise PdfError('unexpected token %r' % token)
+
+""" decode a name token """
+def parse_name(token):
+  return Name(NAME_HEX.sub(lambda m: chr(int(m.group(1), 16)), token[1:]))
+
+""" convert a text string to plain ASCII, as pdftk does """
+def text_string(value):
+  if not isinstance(value, str):
+    return ''
+  if value.startswith('\xfe\xff'):
+    text = value[2:].decode('utf-16-be', 'replace')
+  else:
+    text = value.decode('latin-1')
+  return text.encode('ascii', 'xmlcharrefreplace')
+
+########################################################### FILTERS
+
+""" undo the PNG predictors applied to Flate encoded data """
+def png_unpredict(data, parms):
+  predictor = parms.get('Predictor', 1)
+  if predictor == 1:
+    return data
+  if predictor < 10:
+    raise PdfError('unsupported predictor %d' % predictor)
+
+  colors  = parms.get('Colors', 1)
+  bits    = parms.get('BitsPerComponent', 8)
+  columns = parms.get('Columns', 1)
+  bpp     = max(1, colors * bits / 8)
+  rowlen  = (colors * bits * columns + 7) / 8
+
+  output = []
+  prior  = bytearray(rowlen)
+  for start in range(0, len(data) - rowlen, rowlen + 1):
+    kind = ord(data[start])
+    row  = bytearray(data[start+1:start+1+rowlen])
+    if kind == 1:
+      for i in range(bpp, rowlen):
+        row[i] = (row[i] + row[i-bpp]) & 0xff
+    elif kind == 2:
+      for i in range(rowlen):
+        row[i] = (row[i] + prior[i]) & 0xff
+    elif kind == 3:
+      for i in range(rowlen):
+        left = i >= bpp and row[i-bpp] or 0
+        row[i] = (row[i] + (left + prior[i]) / 2) & 0xff
+    elif kind == 4:
+      for i in range(rowlen):
+        a = i >= bpp and row[i-bpp] or 0
+        b = prior[i]
+        c = i >= bpp and prior[i-bpp] or 0
+        pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2*c)
+        if pa <= pb and pa <= pc:
+          row[i] = (row[i] + a) & 0xff
+        elif pb <= pc:
+          row[i] = (row[i] + b) & 0xff
+        else:
+          row[i] = (row[i] + c) & 0xff
+    output.append(str(row))
+    prior = row
+
+  return ''.join(output)
+
+""" decode ASCII85 data """
+def ascii85_decode(data):
+  data = re.sub('[%s]' % WHITESPACE, '', data)
+  if data.startswith('<~'):
+    data = data[2:]
+  data = data.split('~>')[0]
+
+  output, group = [], []
+  for char in data:
+    if char == 'z' and not group:
+      output.append('\0\0\0\0')
+      continue
+    group.append(ord(char) - 33)
+    if len(group) == 5:
+      value = reduce(lambda a, b: a * 85 + b, group)
+      output.append(binascii.unhexlify('%08x' % value))
+      group = []
+
+  if group:
+    n = len(group)
+    value = reduce(lambda a, b: a * 85 + b, group + [84] * (5 - n))
+    output.append(binascii.unhexlify('%08x' % value)[:n-1])
+
+  return ''.join(output)
+
+""" decode Flate data, keeping whatever precedes a damaged tail """
+def flate_decode(data):
+  decoder = zlib.decompressobj()
+  try:
+    return decoder.decompress(data) + decoder.flush()
+  except zlib.error:
+    if decoder.unused_data or not data:
+      raise
+    return zlib.decompressobj().decompress(data[:-1])
+
+""" wrap CCITT fax data in a TIFF file, so that PIL can decode it """
+def ccitt_tiff(data, width, height, parms):
+  k = parms.get('K', 0)
+  compression, options = k < 0 and (4, 293) or (3, 292)
+  t4options = k > 0 and 1 or 0
+  if parms.get('EncodedByteAlign') and compression == 3:
+    t4options |= 4
+
+  # PIL and libtiff treat 0 as white unless told otherwise
+  photometric = parms.get('BlackIs1') and 1 or 0
+
+  entries = [ (256, 4, width), (257, 4, height), (258, 3, 1),
+              (259, 3, compression), (262, 3, photometric), (273, 4, 0),
+              (277, 3, 1), (278, 4, height), (279, 4, len(data)),
+              (options, 4, t4options) ]
+  entries.sort()
+
+  offset = 8 + 2 + 12 * len(entries) + 4
+  ifd    = [ struct.pack('<H', len(entries)) ]
+  for tag, kind, value in entries:
+    if tag == 273:
+      value = offset
+    if kind == 3:
+      ifd.append(struct.pack('<HHIHH', tag, kind, 1, value, 0))
+    else:
+      ifd.append(struct.pack('<HHII', tag, kind, 1, value))
+
+  return 'II*\0' + struct.pack('<I', 8) + ''.join(ifd) + \
+         struct.pack('<I', 0) + data
+
+""" multiply two transformation matrices """
+def multiply(m1, m2):
+  a1, b1, c1, d1, e1, f1 = m1
+  a2, b2, c2, d2, e2, f2 = m2
+  return (a1*a2 + b1*c2, a1*b2 + b1*d2, c1*a2 + d1*c2, c1*b2 + d1*d2,
+          e1*a2 + f1*c2 + e2, e1*b2 + f1*d2 + f2)
+
+###################################################### DOCUMENT
+
+""" a PDF document, read without any external program """
+class PdfDocument(object):
+
+  """ open a document and read its cross-reference information """
+  def __init__(self, name):
+    self.file = open(name, 'rb')
+    try:
+      self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError), e:
+      self.file.close()
+      raise PdfError('unable to map document: %s' % e)
+
+    self.xref, self.trailer, self.objects = {}, {}, {}
+    self.objstms, self.page_list, self.dests = {}, None, None
+    self.encrypted = False
+    try:
+      self.read_xref()
+      self.root()
+    except (PdfError, ValueError, IndexError, TypeError, zlib.error):
+      # damaged cross-reference information, find the objects by scanning
+      self.objects = {}
+      self.rebuild_xref()
+
+    self.encrypted = 'Encrypt' in self.trailer
+
+  """ release the document """
+  def close(self):
+    self.data.close()
+    self.file.close()
+
+  ###################################################### CROSS-REFERENCE
+
+  """ read the chain of cross-reference sections, newest first """
+  def read_xref(self):
+    matches = STARTXREF.findall(self.data[-2048:])
+    if not matches:
+      raise PdfError('startxref not found')
+
+    offset, seen = int(matches[-1]), {}
+    while offset is not None and not seen.has_key(offset):
+      seen[offset] = True
+      section = {}
+      token, pos = next_token(self.data, offset)
+      if token == 'xref':
+        trailer = self.read_xref_table(pos, section)
+        if trailer.has_key('XRefStm'):
+          self.read_xref_stream(trailer['XRefStm'], section)
+      else:
+        trailer = self.read_xref_stream(offset, section)
+
+      # newer sections take precedence, free entries included, so that an
+      # older section cannot bring back an object which has been deleted
+      for num, entry in section.items():
+        self.xref.setdefault(num, entry)
+      for key, value in trailer.items():
+        self.trailer.setdefault(key, value)
+      offset = trailer.get('Prev')
+
+  """ read a cross-reference table into a section, returning the trailer
+      following it; free entries are recorded as None """
+  def read_xref_table(self, pos, section):
+    while True:
+      token, pos = next_token(self.data, pos)
+      if token == 'trailer':
+        return parse_object(self.data, pos)[0]
+
+      start      = int(token)
+      count, pos = next_token(self.data, pos)
+      for i in range(int(count)):
+        match = XREF_ENTRY.match(self.data, pos)
+        if not match:
+          raise PdfError('invalid cross-reference entry at %d' % pos)
+
+        if match.group(3) == 'n':
+          section[start + i] = (1, int(match.group(1)), int(match.group(2)))
+        else:
+          section[start + i] = None
+        pos = match.end()
+
+  """ read a cross-reference stream into a section, returning its
+      dictionary; it only fills the gaps left in the section, which are the
+      objects kept in object streams when it belongs to a hybrid file """
+  def read_xref_stream(self, offset, section):
+    stream = self.read_indirect(offset)
+    if not isinstance(stream, Stream) or stream.dict.get('Type') != 'XRef':
+      raise PdfError('invalid cross-reference stream at %d' % offset)
+
+    dict   = stream.dict
+    widths = dict['W']
+    index  = dict.get('Index', [0, dict['Size']])
+    data   = self.decode(stream)
+
+    pos = 0
+    for s in range(0, len(index) - 1, 2):
+      start, count = index[s], index[s+1]
+      for i in range(count):
+        fields = []
+        for width in widths:
+          value = 0
+          for byte in data[pos:pos+width]:
+            value = (value << 8) | ord(byte)
+          fields.append(value)
+          pos += width
+
+        if not widths[0]:
+          fields[0] = 1
+        if fields[0] in (1, 2) and section.get(start + i) is None:
+          section[start + i] = tuple(fields[:3])
+        else:
+          section.setdefault(start + i, None)
+
+    return dict
+
+  """ rebuild the cross-reference information by scanning the file """
+  def rebuild_xref(self):
+    self.xref, self.trailer = {}, {}
+    for match in OBJ_HEADER.finditer(self.data):
+      self.xref[int(match.group(1))] = (1, match.start(), int(match.group(2)))
+
+    for match in TRAILER.finditer(self.data):
+      try:
+        self.trailer.update(parse_object(self.data, match.end() - 2)[0])
+      except PdfError:
+        pass
+
+    # pick up the objects which are only stored in object streams
+    for num in self.xref.keys():
+      stream = self.get(num)
+      if isinstance(stream, Stream) and stream.dict.get('Type') == 'ObjStm':
+        for i, (objnum, offset) in enumerate(self.read_objstm(num)[1]):
+          self.xref.setdefault(objnum, (2, num, i))
+
+    if not isinstance(self.resolve(self.trailer.get('Root')), dict):
+      for num in self.xref.keys():
+        obj = self.get(num)
+        if isinstance(obj, dict) and obj.get('Type') == 'Catalog':
+          self.trailer['Root'] = Ref((num, 0))
+          break
+
+    self.root()
+
+  ###################################################### OBJECTS
+
+  """ get an indirect object by number """
+  def get(self, num):
+    if self.objects.has_key(num):
+      return self.objects[num]
+
+    # guard against objects which refer to themselves while loading
+    self.objects[num] = None
+    entry, obj = self.xref.get(num) or (0,), None
+    try:
+      if entry[0] == 1:
+        obj = self.read_indirect(entry[1])
+      elif entry[0] == 2:
+        data, offsets = self.read_objstm(entry[1])
+        obj = parse_object(data, offsets[entry[2]][1])[0]
+    except (PdfError, ValueError, IndexError, TypeError, zlib.error):
+      obj = None
+
+    self.objects[num] = obj
+    return obj
+
+  """ follow a reference, leaving direct objects as they are """
+  def resolve(self, value):
+    if isinstance(value, Ref):
+      return self.get(value[0])
+    return value
+
+  """ read the indirect object at an offset """
+  def read_indirect(self, offset):
+    num, pos = next_token(self.data, offset)
+    gen, pos = next_token(self.data, pos)
+    obj, pos = next_token(self.data, pos)
+    if obj != 'obj':
+      raise PdfError('no object at %d' % offset)
+
+    obj, pos = parse_object(self.data, pos)
+    if not isinstance(obj, dict):
+      return obj
+
+    match = TOKEN.match(self.data, pos)
+    if not match or match.group(1) != 'stream':
+      return obj
+
+    start = match.end()
+    if self.data[start:start+2] == '\r\n':
+      start += 2
+    elif self.data[start:start+1] in '\r\n':
+      start += 1
+
+    # trust the length only if the stream really ends there
+    length = self.resolve(obj.get('Length'))
+    if not isinstance(length, int) or \
+       self.data[start+length:start+length+32].strip()[:9] != 'endstream':
+      end = self.data.find('endstream', start)
+      if end < 0:
+        raise PdfError('unterminated stream at %d' % offset)
+      length = len(self.data[start:end].rstrip('\r\n'))
+
+    return Stream(obj, self.data[start:start+length])
+
+  """ read an object stream, returning its data and the object offsets """
+  def read_objstm(self, num):
+    if not self.objstms.has_key(num):
+      stream = self.get(num)
+      if not isinstance(stream, Stream):
+        raise PdfError('missing object stream %d' % num)
+
+      data, first = self.decode(stream), stream.dict['First']
+      offsets, pos = [], 0
+      for i in range(stream.dict['N']):
+        objnum, pos = next_token(data, pos)
+        offset, pos = next_token(data, pos)
+        offsets.append( (int(objnum), first + int(offset)) )
+      self.objstms[num] = data, offsets
+
+    return self.objstms[num]
+
+  """ decode the data of a stream """
+  def decode(self, stream):
+    return self.partial_decode(stream)[0]
+
+  """ apply the filters of a stream until one of those in keep, returning
+      the data and the (filter, parameters) pairs which are left """
+  def partial_decode(self, stream, keep=()):
+    if self.encrypted and stream.dict.get('Type') != 'XRef':
+      raise PdfError('document is encrypted')
+
+    filters = self.resolve(stream.dict.get('Filter'))
+    parms   = self.resolve(stream.dict.get('DecodeParms'))
+    if not isinstance(filters, list):
+      filters, parms = [filters], [parms]
+    elif not isinstance(parms, list):
+      parms = [parms] * len(filters)
+
+    pairs = [ (self.resolve(filter), self.resolve(parm) or {})
+              for filter, parm in zip(filters, parms) if filter is not None ]
+
+    data = stream.data
+    for i, (filter, parm) in enumerate(pairs):
+      if filter in keep:
+        return data, pairs[i:]
+      elif filter in ('FlateDecode', 'Fl'):
+        data = png_unpredict(flate_decode(data), parm)
+      elif filter in ('ASCIIHexDecode', 'AHx'):
+        data = parse_object('<%s>' % data.split('>')[0], 0)[0]
+      elif filter in ('ASCII85Decode', 'A85'):
+        data = ascii85_decode(data)
+      else:
+        raise PdfError('unsupported filter %s' % filter)
+
+    return data, []
+
+  ###################################################### STRUCTURE
+
+  """ the document catalog """
+  def root(self):
+    root = self.resolve(self.trailer.get('Root'))
+    if not isinstance(root, dict):
+      raise PdfError('document catalog not found')
+    return root
+
+  """ the number of pages in the document """
+  def page_count(self):
+    pages = self.resolve(self.root().get('Pages'))
+    if isinstance(pages, dict):
+      count = self.resolve(pages.get('Count'))
+      if isinstance(count, int) and count > 0:
+        return count
+
+    return len(self.pages())
+
+  """ the pages, as (reference, dictionary) with inherited attributes """
+  def pages(self):
+    if self.page_list is not None:
+      return self.page_list
+
+    self.page_list, seen = [], {}
+    stack = [ (self.root().get('Pages'), {}) ]
+    while stack:
+      ref, inherited = stack.pop()
+      if isinstance(ref, Ref):
+        if seen.has_key(ref):
+          continue
+        seen[ref] = True
+
+      node = self.resolve(ref)
+      if not isinstance(node, dict):
+        continue
+
+      attrs = inherited.copy()
+      for key in INHERITED:
+        if node.has_key(key):
+          attrs[key] = node[key]
+
+      kids = self.resolve(node.get('Kids'))
+      if node.get('Type') == 'Pages' or isinstance(kids, list):
+        for kid in reversed(kids or []):
+          stack.append( (kid, attrs) )
+      else:
+        page = node.copy()
+        page.update(attrs)
+        self.page_list.append( (ref, page) )
+
+    return self.page_list
+
+  """ the displayed size of every page, in points """
+  def page_sizes(self):
+    sizes = []
+    for ref, page in self.pages():
+      box = self.resolve(page.get('CropBox')) or \
+            self.resolve(page.get('MediaBox')) or [0, 0, 612, 792]
+      x0, y0, x1, y1 = [ self.resolve(value) for value in box ]
+      size = abs(x1 - x0), abs(y1 - y0)
+      if (self.resolve(page.get('Rotate')) or 0) % 180:
+        size = size[1], size[0]
+      sizes.append(size)
+
+    return sizes
+
+  """ the outline, as (title, level, page) for every entry with a page """
+  def outlines(self):
+    outlines = self.resolve(self.root().get('Outlines'))
+    if not isinstance(outlines, dict):
+      return []
+
+    numbers = {}
+    for i, (ref, page) in enumerate(self.pages()):
+      numbers[ref] = i + 1
+
+    toc, seen = [], {}
+    stack = [ (outlines.get('First'), 1) ]
+    while stack:
+      ref, level = stack.pop()
+      if not isinstance(ref, Ref) or seen.has_key(ref):
+        continue
+      seen[ref] = True
+
+      item = self.resolve(ref)
+      if not isinstance(item, dict):
+        continue
+
+      page = self.destination_page(item, numbers)
+      if page:
+        toc.append( (text_string(self.resolve(item.get('Title'))), level, page) )
+
+      # children come before the following siblings
+      stack.append( (item.get('Next'), level) )
+      stack.append( (item.get('First'), level + 1) )
+
+    return toc
+
+  """ the page number an outline item points to, or None """
+  def destination_page(self, item, numbers):
+    dest = item.get('Dest')
+    if dest is None:
+      action = self.resolve(item.get('A'))
+      if isinstance(action, dict) and action.get('S') == 'GoTo':
+        dest = action.get('D')
+
+    dest = self.resolve(dest)
+    if isinstance(dest, str):
+      dest = self.resolve(self.named_destinations().get(dest))
+    if isinstance(dest, dict):
+      dest = self.resolve(dest.get('D'))
+
+    if isinstance(dest, list) and dest:
+      if isinstance(dest[0], Ref):
+        return numbers.get(dest[0])
+      if isinstance(dest[0], int):
+        return dest[0] + 1
+
+    return None
+
+  """ the named destinations, from both the catalog and the name tree """
+  def named_destinations(self):
+    if self.dests is not None:
+      return self.dests
+
+    self.dests = {}
+    root  = self.root()
+    dests = self.resolve(root.get('Dests'))
+    if isinstance(dests, dict):
+      self.dests.update(dests)
+
+    names = self.resolve(root.get('Names'))
+    stack, seen = [ isinstance(names, dict) and names.get('Dests') ], {}
+    while stack:
+      node = stack.pop()
+      if isinstance(node, Ref):
+        if seen.has_key(node):
+          continue
+        seen[node] = True
+      node = self.resolve(node)
+      if not isinstance(node, dict):
+        continue
+
+      pairs = self.resolve(node.get('Names')) or []
+      for i in range(0, len(pairs) - 1, 2):
+        self.dests[self.resolve(pairs[i])] = pairs[i+1]
+      stack.extend(self.resolve(node.get('Kids')) or [])
+
+    return self.dests
+
+  ###################################################### PAGE IMAGES
+
+  """ the image XObject which makes up a whole page, or None when the page
+      draws anything else as well """
+  def page_xobject(self, n):
+    pages = self.pages()
+    if n < 1 or n > len(pages):
+      return None
+
+    page      = pages[n-1][1]
+    resources = self.resolve(page.get('Resources')) or {}
+    xobjects  = self.resolve(resources.get('XObject')) or {}
+    contents  = self.resolve(page.get('Contents'))
+    if not isinstance(contents, list):
+      contents = [contents]
+
+    streams = [ self.resolve(stream) for stream in contents ]
+    if not streams or [ x for x in streams if not isinstance(x, Stream) ]:
+      return None
+    data = '\n'.join([ self.decode(stream) for stream in streams ])
+
+    # follow the graphics state, accepting only a single painted image
+    image, ctm, stack, operands, pos = None, (1, 0, 0, 1, 0, 0), [], [], 0
+    while True:
+      match = TOKEN.match(data, pos)
+      if not match:
+        break
+
+      token = match.group(1)
+      if token[0] in '/[(<' or token in ('true', 'false', 'null') or \
+         NUMBER.match(token):
+        value, pos = parse_object(data, pos)
+        operands.append(value)
+        continue
+
+      pos = match.end()
+      if token == 'q':
+        stack.append(ctm)
+      elif token == 'Q':
+        ctm = stack and stack.pop() or ctm
+      elif token == 'cm' and len(operands) >= 6:
+        ctm = multiply(operands[-6:], ctm)
+      elif token == 'Do' and operands and image is None:
+        image = self.resolve(xobjects.get(operands[-1]))
+        if not isinstance(image, Stream) or \
+           image.dict.get('Subtype') != 'Image':
+          return None
+        matrix = ctm
+      elif token not in STATE_OPS:
+        return None
+      operands = []
+
+    if image is None:
+      return None
+
+    # the image must be upright and cover most of the page
+    a, b, c, d, e, f = matrix
+    box = self.resolve(page.get('MediaBox')) or [0, 0, 612, 792]
+    area = abs((box[2] - box[0]) * (box[3] - box[1]))
+    if b or c or a <= 0 or d <= 0 or a * d < area * MIN_COVERAGE:
+      return None
+
+    return image
+
+  """ decode the image which makes up a whole page, or return None """
+  def page_image(self, n):
+    stream = self.page_xobject(n)
+    if stream is None:
+      return None
+
+    dict = stream.dict
+    if dict.get('ImageMask') or dict.has_key('SMask') or dict.has_key('Mask'):
+      return None
+
+    width  = self.resolve(dict.get('Width'))
+    height = self.resolve(dict.get('Height'))
+    bits   = self.resolve(dict.get('BitsPerComponent'))
+    decode = self.resolve(dict.get('Decode'))
+    space  = self.resolve(dict.get('ColorSpace'))
+    if isinstance(space, list) and space and space[0] == 'ICCBased':
+      profile = self.resolve(space[1])
+      space   = { 1 : 'DeviceGray', 3 : 'DeviceRGB' }.get(
+                  isinstance(profile, Stream) and profile.dict.get('N'))
+    elif isinstance(space, list) and space:
+      space = space[0]
+
+    data, rest = self.partial_decode(stream, IMAGE_FILTERS)
+    if rest:
+      filter, parms = rest[0]
+      if len(rest) > 1:
+        return None
+      elif filter in ('CCITTFaxDecode', 'CCF'):
+        image = Image.open(StringIO.StringIO(ccitt_tiff(data, width, height,
+                                                        parms)))
+      else:
+        image = Image.open(StringIO.StringIO(data))
+      image.load()
+      if image.mode not in ('1', 'L', 'RGB'):
+        return None
+
+    else:
+      components = COMPONENTS.get(space)
+      if components is None or bits not in (1, 8) or \
+         (bits == 1 and components != 1):
+        return None
+
+      mode = { 1 : 'L', 3 : 'RGB' }[components]
+      if bits == 1:
+        mode = '1'
+      size = (width * components * bits + 7) / 8 * height
+      if len(data) < size:
+        return None
+      image = Image.fromstring(mode, (width, height), data[:size])
+
+    # an inverted decode array, as used for white-is-one scans
+    if isinstance(decode, list) and decode[:2] == [1, 0]:
+      image = ImageChops.invert(image.convert(image.mode == '1' and 'L' or
+                                              image.mode))
+
+    rotate = self.resolve(self.pages()[n-1][1].get('Rotate')) or 0
+    if ROTATE.has_key(rotate % 360):
+      image = image.transpose(ROTATE[rotate % 360])
+
+    return image
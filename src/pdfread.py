@@ -22,53 +22,202 @@
 
 ##############################################################################
 
-import os, sys, glob, optparse
+import os, sys, glob, math, shutil, tempfile, threading, optparse, Queue
 
 
 from common  import *
 from process import *
 from input   import *
 from output  import *
+from cache   import *
 
 OUT_FORMATS = get_plugins(BaseOutput)
 IN_FORMATS  = get_plugins(BaseInput)
 MODES       = get_plugins(BaseMode)
 
-def convert(pages, input, mode_tranform, output, crop_percent,
-            unpaper_args=None, no_crop=False, no_dilate=False):
+""" run the processing stages on a single page image, once for every mode """
+def process_image(image, modes, crop_percent, unpaper_args=None,
+                  no_crop=False, no_dilate=False, engine=DEFAULT_ENGINE,
+                  dilation=DEFAULT_DILATION):
 
-  for page in pages:
-    p('Page %4d/%d: %s', page, input.count, 'EXTRACT ')
+  if unpaper_args:
+    image = unpaper(image, unpaper_args)
+    if not image:
+      return None
 
-    image = input.get_page(page)
+  if not no_crop:
+    image = crop(image, crop_percent)
     if not image:
-      p('BLANK\n')
-      continue
+      return None
+
+  if not no_dilate and dilation:
+    image = dilate(image, engine, dilation)
+
+  return [ mode_tranform(image) for mode_tranform in modes ]
+
+""" initialise a worker process with its own scratch directory """
+def init_worker(tempdir, *args):
+  global WORKER_ARGS
+  WORKER_ARGS = args
+
+  silence()
+  os.chdir(tempfile.mkdtemp(prefix='worker-', dir=tempdir))
+
+""" process a single page image inside a worker process """
+def process_worker(data):
+  results = process_image(unpack_images(data)[0], *WORKER_ARGS)
+  if results is None:
+    return None
+
+  return [ pack_images(images) for images in results ]
+
+""" pipeline stage: rasterize the pages which are not cached, in order """
+def read_stage(pages, input, caches, queue):
+  silence()
+  try:
+    for page in pages:
+      cached = None
+      if None not in caches:
+        cached = [ cache.get_page(page) for cache in caches ]
+        if None in cached:
+          cached = None
+
+      if cached is not None:
+        queue.put( (page, None, cached) )
+      else:
+        # decode now, the input may reuse its files for the next page
+        image = input.get_page(page)
+        if image:
+          image.load()
+        queue.put( (page, image, None) )
+  except:
+    queue.put( (None, sys.exc_info(), None) )
+
+  queue.put(None)
+
+""" pipeline stage: hand the rasterized pages to the processing pool """
+def process_stage(input_queue, output_queue, submit):
+  silence()
+  while True:
+    item = input_queue.get()
+    if item is None:
+      break
+
+    page, image, cached = item
+    if page is not None and image:
+      image = submit(image)
+
+    output_queue.put( (page, image, cached) )
+
+  output_queue.put(None)
+
+""" cache the pages whose images have been optimized, returning the others """
+def cache_pages(waiting):
+  pending = []
+  for cache, output, page, files in waiting:
+    if output.optimized(files):
+      cache.put_page(page, files)
+    else:
+      pending.append( (cache, output, page, files) )
+  return pending
+
+""" start a daemon thread running a pipeline stage """
+def start_stage(target, *args):
+  thread = threading.Thread(target=target, args=args)
+  thread.setDaemon(True)
+  thread.start()
+  return thread
+
+""" convert pages, fanning each one out to a list of (mode, output, cache) """
+def convert(pages, input, targets, crop_percent,
+            unpaper_args=None, no_crop=False, no_dilate=False, jobs=1,
+            read_queue=DEFAULT_READ_QUEUE, write_queue=0,
+            engine=DEFAULT_ENGINE, dilation=DEFAULT_DILATION):
+
+  from multiprocessing import Pool
+  from multiprocessing.pool import ThreadPool
+
+  modes  = [ mode for mode, output, cache in targets ]
+  caches = [ cache for mode, output, cache in targets ]
+  args   = (modes, crop_percent, unpaper_args, no_crop, no_dilate, engine,
+            dilation)
+
+  # worker processes need their own scratch directory and a picklable image,
+  # a single worker thread can share the current directory with the others
+  if jobs > 1:
+    pool   = Pool(jobs, init_worker, (os.getcwd(),) + args)
+    submit = lambda image: pool.apply_async(process_worker,
+                                            (pack_images([image]),))
+  else:
+    pool   = ThreadPool(1, silence)
+    submit = lambda image: pool.apply_async(process_image, (image,) + args)
 
-    if unpaper_args:
-      image = unpaper(image, unpaper_args)
-      if not image:
-        p('BLANK\n')
+  # the queues bound the number of pages waiting to be processed and written
+  rasterized = Queue.Queue(max(1, read_queue))
+  processed  = Queue.Queue(max(1, write_queue or 2*jobs))
+
+  # pages are only cached once their images have been optimized, the ones
+  # still waiting for that are kept as (cache, output, page, files)
+  waiting    = []
+
+  try:
+    start_stage(read_stage, pages, input, caches, rasterized)
+    start_stage(process_stage, rasterized, processed, submit)
+
+    while True:
+      item = processed.get()
+      if item is None:
+        break
+
+      page, result, cached = item
+      if page is None:
+        raise result[0], result[1], result[2]
+
+      p('Page %4d/%d: ', page, input.count)
+
+      if cached is not None:
+        for (mode, output, cache), files in zip(targets, cached):
+          if files != BLANK_PAGE:
+            output.add_cached_page(page, files)
+        p(cached.count(BLANK_PAGE) == len(cached) and 'BLANK\n' or 'CACHED\n')
         continue
 
-    if not no_crop:
-      image = crop(image, crop_percent)
-      if not image:
+      results = result and result.get()
+      if results and jobs > 1:
+        results = [ unpack_images(images) for images in results ]
+
+      if not results:
+        for mode, output, cache in targets:
+          if cache:
+            cache.put_page(page, None)
         p('BLANK\n')
         continue
 
-    if not no_dilate:
-      image = dilate(image)
+      for (mode, output, cache), images in zip(targets, results):
+        files = output.add_page(page, images)
+        if cache:
+          waiting.append( (cache, output, page, files) )
+      waiting = cache_pages(waiting)
+      p('DONE\n')
 
-    output.add_page(page, mode_tranform(image))
-    p('DONE\n')
+    for mode, output, cache in targets:
+      output.flush()
+    cache_pages(waiting)
+
+    pool.close()
+
+  finally:
+    pool.terminate()
+    pool.join()
+    for dir in glob.glob('worker-*'):
+      shutil.rmtree(dir, True)
 
   # remove all temporary files
   for file in glob.glob('page*.*'):
     os.remove(file)
 
 def main():
-  input, output, mode, options, parser = parse_cmdline()
+  input, targets, options, parser = parse_cmdline()
 
   first = options.first_page or 1
   last  = options.last_page  or input.count
@@ -80,10 +229,34 @@ def main():
   cwd = os.getcwd()
   os.chdir(options.tempdir)
 
-  convert(pages, input, mode, output, options.crop_percent,
-          options.unpaper_args, options.no_crop, options.no_dilate)
+  for mode, output, opt in targets:
+    if not os.path.isdir(output.dir):
+      os.mkdir(output.dir)
+
+  if options.cache:
+    digest  = file_hash(input.input)
+    cache   = DiskCache(os.path.join(options.cache, 'pages'),
+                        options.cache_size << 20)
+    targets = [ (mode, output, PageCache(cache, digest, opt))
+                for mode, output, opt in targets ]
+    if options.raster_cache and input.rasterizes:
+      input = RasterCache(os.path.join(options.cache, 'raster'),
+                          options.raster_cache << 20, input, digest,
+                          options.__dict__)
+  else:
+    targets = [ (mode, output, None) for mode, output, opt in targets ]
+
+  convert(pages, input, targets, options.crop_percent,
+          options.unpaper_args, options.no_crop, options.no_dilate,
+          options.jobs, options.read_queue, options.write_queue,
+          options.engine, options.dilation)
+
+  delete = True
+  for mode, output, cache in targets:
+    os.chdir(output.dir)
+    delete = output.generate(input.toc) and delete
+    os.chdir(options.tempdir)
 
-  delete = output.generate(input.toc)
   os.chdir(cwd)
 
   if delete:
@@ -109,9 +282,17 @@ def parse_cmdline():
                       edge_level=DEFAULT_EDGE_ENHANCE,
                       crop_percent=DEFAULT_CROP_PERCENT,
                       overlap_h=DEFAULT_OVERLAP_H, overlap_v=DEFAULT_OVERLAP_V,
+                      jobs=DEFAULT_JOBS, chunk_size=DEFAULT_CHUNK_SIZE,
+                      read_queue=DEFAULT_READ_QUEUE, write_queue=0,
+                      cache_size=DEFAULT_CACHE_SIZE,
+                      raster_cache=DEFAULT_RASTER_CACHE,
+                      image_cache=DEFAULT_IMAGE_CACHE,
+                      engine=DEFAULT_ENGINE, quantizer=DEFAULT_QUANTIZER,
+                      dither=DEFAULT_DITHER, optimizer=DEFAULT_OPTIMIZER,
                       title='Unknown', author='Unknown', category='General')
 
-  parser.add_option('-p', dest='profile', choices=profiles, help=opt_help(profiles))
+  parser.add_option('-p', dest='profile',
+                    help=opt_help(profiles) + ' (or several, separated by commas)')
   parser.add_option('-o', dest='output',   help='the output filename')
   parser.add_option('-t', dest='title',    help='generated ebook title (default: "%default")')
   parser.add_option('-a', dest='author',   help='generated ebook author (default: "%default")')
@@ -125,13 +306,51 @@ def parse_cmdline():
                     help='command line arguments for unpaper')
   parser.add_option('-d', dest='tempdir', metavar='DIR',
                     help='the temporary directory where images are generated')
+  parser.add_option('-j', '--jobs', type='int', metavar='N',
+                    help='number of pages to process in parallel (default: %default)')
+  parser.add_option('--read-queue', type='int', metavar='N',
+                    help='pages rasterized ahead of processing (default: %default)')
+  parser.add_option('--write-queue', type='int', metavar='N',
+                    help='pages processed ahead of writing (default: twice the jobs)')
+  parser.add_option('--chunk-size', type='int', metavar='N',
+                    help='number of pages to rasterize at once (default: %default)')
+  parser.add_option('--pipe', action='store_true',
+                    help='read rasterized pages through pipes instead of files')
+  parser.add_option('--libgs', action='store_true',
+                    help='render PDF pages with the Ghostscript shared library')
+  parser.add_option('--extract-images', action='store_true',
+                    help='decode the single image of scanned PDF pages directly')
+  parser.add_option('--render-region', action='store_true',
+                    help='render only the inked region of PDF pages, found by '
+                         'a low resolution pre-pass')
+  parser.add_option('--cache', metavar='DIR',
+                    help='reuse page images and rasters cached in this directory')
+  parser.add_option('--cache-size', type='int', metavar='MB',
+                    help='maximum size of the page image cache (default: %default)')
+  parser.add_option('--raster-cache', type='int', metavar='MB',
+                    help='maximum size of the raster cache, 0 to disable it '
+                         '(default: %default)')
+  parser.add_option('--image-cache', type='int', metavar='N',
+                    help='decoded images kept from an image list (default: %default)')
+  parser.add_option('--engine', choices=['pil', 'numpy'],
+                    help='the minimum filter used for dilation, pil or a '
+                         'numpy one (default: %default)')
+  parser.add_option('--quantizer', choices=['internal', 'pngnq'],
+                    help='how gray images are reduced to the device colors (default: %default)')
+  parser.add_option('--dither', choices=['none', 'ordered', 'fs'],
+                    help='dithering used by the internal quantizer (default: %default)')
   parser.add_option('--first-page', metavar='PAGE', type='int', help='first page to convert')
   parser.add_option('--last-page', metavar='PAGE', type='int',  help='last page to convert')
   parser.add_option('--optimize', action='store_true', help='optimize generated PNG images')
+  parser.add_option('--optimizer', choices=['optipng', 'internal'],
+                    help='optipng, or internal to recompress images in '
+                         'process (default: %default)')
   parser.add_option('--crop-percent', type='float', metavar='N%', help='whitespace cropping percentage (default: %default%)')
   parser.add_option('--edge-level', type='int', metavar='L', help='edge enhancement level from 1-9 (default: %default)')
-  parser.add_option('--dpi', type='int',
-                    help='the DPI at which to perform dilation (default: %default)')
+  parser.add_option('--dpi',
+                    help='the DPI at which to perform dilation, or "auto" to '
+                         'pick the lowest one each profile needs and scale '
+                         'the dilation to it (default: %default)')
   parser.add_option('--colors', metavar='N', type='int',
                     help='downsample the output image to N grayscale colors')
   parser.add_option('--colorspace', metavar='TYPE', choices=COLORSPACE.keys(),
@@ -162,44 +381,125 @@ def parse_cmdline():
     parser.print_help()
     sys.exit(0)
 
-  if options.vres is None:
-    options.vres       = PROFILES[options.profile]['vres']
-
-  if options.hres is None:
-    options.hres       = PROFILES[options.profile]['hres']
-
-  if options.rotate is None:
-    options.rotate     = PROFILES[options.profile]['rotate']
-
-  if options.colors is None:
-    options.colors     = PROFILES[options.profile]['colors']
-
-  if options.out_format is None:
-    options.out_format = PROFILES[options.profile]['format']
-
-  if options.mode is None:
-    options.mode       = PROFILES[options.profile]['mode']
+  options.profile = options.profile.split(',')
+  for profile in options.profile:
+    if profile not in PROFILES:
+      parser.error('unknown profile: %s' % profile)
 
   if not options.tempdir:
-    import tempfile
     options.tempdir    = tempfile.mkdtemp(prefix='pdfread-')
 
   if options.output:
     options.output     = os.path.abspath(options.output)
 
+  if options.cache:
+    options.cache      = os.path.abspath(options.cache)
+
   if not os.path.exists(args[0]) or not os.access(args[0], os.R_OK):
     parser.error('input document does not exist or cannot be opened')
 
-  check_commands()
+  if options.libgs and options.render_region:
+    parser.error('--render-region cannot be used with --libgs')
 
-  opt = options.__dict__
-  input  = IN_FORMATS[options.in_format](os.path.abspath(args[0]), **opt)
-  output = OUT_FORMATS[options.out_format](**opt)
-  mode   = MODES[options.mode](**opt)
+  if options.engine == 'numpy':
+    try:
+      import numpy
+    except ImportError:
+      parser.error('the numpy engine needs NumPy to be installed')
+
+  # an explicit DPI is the one to dilate at, a chosen one keeps the strokes
+  # as heavy as they are at the default DPI
+  options.dilation = DEFAULT_DILATION
+  if options.dpi != 'auto':
+    try:
+      options.dpi = int(options.dpi)
+    except ValueError:
+      parser.error('invalid DPI: %s' % options.dpi)
+
+  check_commands()
 
-  return input, output, mode, options, parser
+  # every profile gets its own mode and output, all of them sharing a page
+  targets = []
+  for profile in options.profile:
+    opt = profile_options(options, profile, len(options.profile) > 1)
+    targets.append( (MODES[opt['mode']](**opt), OUT_FORMATS[opt['out_format']](**opt), opt) )
+
+  if options.dpi == 'auto':
+    options.dpi = auto_dpi(os.path.abspath(args[0]),
+                           [ mode for mode, output, opt in targets ], options)
+    options.dilation = dilation_size(options.dpi)
+    for mode, output, opt in targets:
+      opt['dpi'], opt['dilation'] = options.dpi, options.dilation
+
+  input = IN_FORMATS[options.in_format](os.path.abspath(args[0]),
+                                        **options.__dict__)
+  if not input.count:
+    parser.error('unable to determine the number of pages, use --count N')
+
+  return input, targets, options, parser
+
+""" the lowest DPI which still gives every mode a full detail raster of
+    the most common page size, allowing for the margins cropped away """
+def auto_dpi(name, modes, options):
+  sizes = {}
+  if options.in_format == 'pdf':
+    from pdfdoc import PdfDocument
+    try:
+      document = PdfDocument(name)
+      try:
+        for size in document.page_sizes():
+          sizes[size] = sizes.get(size, 0) + 1
+      finally:
+        document.close()
+    except Exception:
+      pass
+
+  if not sizes:
+    p('Unable to determine the page size, using %d dpi\n', DEFAULT_DPI)
+    return DEFAULT_DPI
+
+  count, (width, height) = max([ (n, size) for size, n in sizes.items() ])
+  content = options.no_crop and 1.0 or AUTO_DPI_CONTENT
+  width   = width  * content / 72.0
+  height  = height * content / 72.0
+
+  dpi = 0
+  for mode in modes:
+    needed_w, needed_h = mode.required_size()
+    ratios = []
+    if needed_w:
+      ratios.append(needed_w / width)
+    if needed_h:
+      ratios.append(needed_h / height)
+    dpi = max(dpi, min(ratios))
+
+  low, high = AUTO_DPI_RANGE
+  dpi = max(low, min(high, int(math.ceil(dpi))))
+  p('Rasterizing at %d dpi\n', dpi)
+  return dpi
+
+""" get the options for a profile, with command line overrides """
+def profile_options(options, profile, multiple=False):
+  opt = dict(options.__dict__)
+  for key in ['hres', 'vres', 'rotate', 'colors', 'mode']:
+    if opt[key] is None:
+      opt[key] = PROFILES[profile][key]
+
+  if opt['out_format'] is None:
+    opt['out_format'] = PROFILES[profile]['format']
+
+  # keep the images and ebooks of several profiles apart
+  if multiple:
+    opt['output_dir'] = profile
+    if opt['output']:
+      name, ext = os.path.splitext(opt['output'])
+      opt['output'] = '%s-%s%s' % (name, profile, ext)
+
+  return opt
 
 ##############################################################################
 
 if __name__ == '__main__':
+  from multiprocessing import freeze_support
+  freeze_support()
   main()
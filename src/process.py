@@ -21,6 +21,11 @@
 
 import os, sys, math, Image, ImageFilter, ImageChops, ImageOps
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
 from common import *
 
 
@@ -29,20 +34,40 @@ from common import *
 MAX_CROP_SIZE = 100
 MAX_CROP_STEP = 10
 
+""" internal function finding which rows (or columns) contain any ink """
+def ink_profile(img, columns=False):
+  w, h = img.size
+  if numpy is not None and img.mode in ('L', 'RGB'):
+    data = numpy.fromstring(img.tostring(), numpy.uint8)
+    ink  = data.reshape((h, w, len(img.getbands()))).any(axis=2)
+    if columns:
+      return list(ink.any(axis=0))
+    return list(ink.any(axis=1))
+
+  # without numpy, scan each row or column exactly once
+  if columns:
+    return [ img.crop((i, 0, i+1, h)).getbbox() is not None for i in range(w) ]
+  return [ img.crop((0, i, w, i+1)).getbbox() is not None for i in range(h) ]
+
 """ internal function for cropping a single axis """
-def crop_axis(input, img, start, end, percent,
+def crop_axis(input, ink, start, end, percent,
               func_crop, func_size, func_pos):
 
   # compute optimal step and size for given axis percentage
   size = min(MAX_CROP_SIZE,  max(1, int((end-start)*percent/100)))
   step = min(MAX_CROP_STEP,  max(1, int(size/10)))
 
+  # running count of inked lines, so any window is tested in constant time
+  total = [0]
+  for line in ink:
+    total.append(total[-1] + line)
+  lines = len(ink)
+
   content    = []
   begin      = start
   blank_area = False
   for i in range(start, end, step):
-    test = img.crop( func_crop(i, i+size) )
-    if test.getbbox() is None:
+    if total[min(i+size, lines)] == total[i]:
       if not blank_area:
         # we've hit a blank area, so save content area
         content.append( (begin, i) )
@@ -119,7 +144,7 @@ def crop(input, percent=DEFAULT_CROP_PERCENT):
   l, t, r, b = box
 
   # crop horizontal blank areas
-  temp = crop_axis(input, img, t, b, percent,
+  temp = crop_axis(input, ink_profile(img), t, b, percent,
                    lambda s, e: (0, s, w, e),
                    lambda s   : (w, s),
                    lambda s   : (0, s))
@@ -128,15 +153,26 @@ def crop(input, percent=DEFAULT_CROP_PERCENT):
   img  = ImageChops.invert(temp)
 
   # crop vertical blank areas
-  return crop_axis(temp, img, l, r, percent,
+  return crop_axis(temp, ink_profile(img, True), l, r, percent,
                    lambda s, e: (s, 0, e, h),
                    lambda s   : (s, h),
                    lambda s   : (s, 0))
 
+""" the size of the dilation filter for pages rasterized at a DPI, which
+    thickens the strokes by as much as the 3x3 filter does at the default
+    DPI, or 0 when that is less than a pixel """
+def dilation_size(dpi):
+  radius = int(round(float(dpi) / DEFAULT_DPI))
+  return radius and 2*radius + 1
+
 """ perform image dilation """
-def dilate(image):
+def dilate(image, engine=DEFAULT_ENGINE, size=DEFAULT_DILATION):
   p('DILATE ')
-  return image.filter(ImageFilter.MinFilter)
+  if engine == 'numpy':
+    from numeric import min_filter
+    return min_filter(image, size)
+
+  return image.filter(ImageFilter.MinFilter(size))
 
 """ perform unpaper cleanup """
 def unpaper(image, args):
@@ -182,6 +218,10 @@ class LandscapeMode(BaseMode):
     self.hres, self.vres, self.overlap = hres, vres, overlap_v
     self.rotate = ROTATION[rotate]
 
+  """ the page is resized to the device height across its width """
+  def required_size(self):
+    return self.vres, None
+
   """ execute """
   def __call__(self, image):
     p('SPLIT ')
@@ -228,6 +268,10 @@ class LandscapeHalfMode(BaseMode):
     self.hres, self.vres, self.overlap = hres, vres, overlap_v
     self.rotate = ROTATION[rotate]
 
+  """ fit the page to 2 device screens stacked vertically """
+  def required_size(self):
+    return self.vres, 2*self.hres - self.overlap
+
   """ execute """
   def __call__(self, image):
     p('SPLIT ')
@@ -245,6 +289,10 @@ class LandscapeThirdMode(BaseMode):
     self.hres, self.vres, self.overlap = hres, vres, overlap_v
     self.rotate = ROTATION[rotate]
 
+  """ fit the page to 3 device screens stacked vertically """
+  def required_size(self):
+    return self.vres, 3*self.hres - 2*self.overlap
+
   """ execute """
   def __call__(self, image):
     p('SPLIT ')
@@ -263,6 +311,10 @@ class PortraitTwoColumnMode(BaseMode):
     self.overlap_v, self.overlap_h = overlap_v, overlap_h
     self.rotate = ROTATION[rotate]
 
+  """ fit the page to a grid of 2x2 device screens """
+  def required_size(self):
+    return 2*self.hres - self.overlap_h, 2*self.vres - self.overlap_v
+
   """ execute """
   def __call__(self, image):
     p('SPLIT ')
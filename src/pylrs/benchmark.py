@@ -0,0 +1,136 @@
+"""
+    benchmark.py -- time the rendering of a synthetic book to lrf.
+
+    Usage: python benchmark.py [pages] [output.lrf]
+           python benchmark.py --tags [count]
+
+    Every page holds a text block with a few styled paragraphs, and an
+    image block, which between them exercise most of the tag writers.
+    With --tags, the tag list optimizer is timed on a text stream instead.
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from pylrs import (Book, PageStyle, BlockStyle, TextStyle, ImageStream,
+        Paragraph, Span, Bold, Italic, CR)
+from pylrf import LrfTag
+from pylrfopt import tagListOptimizer, TEXT_SETTING_TAGS
+
+DEFAULT_PAGES = 10000
+DEFAULT_TAGS = 100000
+
+# a 1x1 gray PNG
+PNG_DATA = ("\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00"
+            "\x01\x08\x00\x00\x00\x00:~\x9bU\x00\x00\x00\nIDATx\x9cc\xf8\x0f"
+            "\x00\x01\x01\x01\x00\x1b\xb6\xeeV\x00\x00\x00\x00IEND\xaeB`\x82")
+
+
+
+def makeBook(nPages):
+    book = Book(title="Benchmark", author="pylrs", category="Test")
+    pageStyle = PageStyle(topmargin="0", oddsidemargin="0",
+                          evensidemargin="0")
+    blockStyle = BlockStyle(blockwidth="600", blockheight="400")
+    textStyle = TextStyle(fontsize="100")
+
+    for i in range(nPages):
+        page = book.Page(pageStyle)
+        textBlock = page.TextBlock(textStyle, blockStyle)
+        for j in range(3):
+            p = Paragraph("Page %d, paragraph %d: " % (i, j))
+            p.append(Bold("some bold text"))
+            p.append(", ")
+            p.append(Italic("some italic text"))
+            p.append(" and ")
+            p.append(Span("larger text", fontsize=140))
+            p.append(CR())
+            textBlock.append(p)
+            textBlock.append(CR())
+
+        page.BlockSpace()
+        stream = ImageStream(data=PNG_DATA, encoding="PNG")
+        page.ImageBlock(refstream=stream, xsize="1", ysize="1",
+                        blockStyle=blockStyle)
+
+    return book
+
+
+
+def makeTagList(nTags):
+    # text interleaved with runs of font changes, as spans produce them
+    random.seed(0)
+    tags = []
+    while len(tags) < nTags:
+        for i in range(random.randint(0, 3)):
+            tags.append(LrfTag(random.choice(["fontsize", "fontweight"]),
+                               random.choice([100, 140, 400, 800])))
+        if random.random() < 0.3:
+            tags.append(LrfTag("textcolor", random.choice(["0x0", "0xff"])))
+        tags.append(LrfTag(random.choice(["rawtext", "rawtext", "CR"]),
+                           "text"))
+
+    return tags[:nTags]
+
+
+
+def benchmarkTags(nTags):
+    for name, tags in [("default tags", None), ("all text settings",
+                                                 TEXT_SETTING_TAGS)]:
+        tagList = makeTagList(nTags)
+        start = time.time()
+        if tags is None:
+            removed = tagListOptimizer(tagList)
+        else:
+            removed = tagListOptimizer(tagList, tags)
+        print "%s: %d of %d tags removed in %.3f s" % (name, removed, nTags,
+                time.time() - start)
+
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--tags":
+        nTags = DEFAULT_TAGS
+        if len(sys.argv) > 2:
+            nTags = int(sys.argv[2])
+        benchmarkTags(nTags)
+        return
+
+    nPages = DEFAULT_PAGES
+    if len(sys.argv) > 1:
+        nPages = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        lrfFilename = sys.argv[2]
+    else:
+        handle, lrfFilename = tempfile.mkstemp(suffix=".lrf")
+        os.close(handle)
+
+    start = time.time()
+    book = makeBook(nPages)
+    built = time.time()
+    book.renderLrf(lrfFilename, incremental=True)
+    rendered = time.time()
+
+    print "%d pages, %d bytes" % (nPages, os.path.getsize(lrfFilename))
+    print "build:  %6.2f s" % (built - start)
+    print "render: %6.2f s (%.0f pages/s)" % (rendered - built,
+            nPages / max(rendered - built, 1e-6))
+    if resource is not None:
+        print "peak memory: %d KB" % \
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if len(sys.argv) <= 2:
+        os.remove(lrfFilename)
+
+
+
+if __name__ == "__main__":
+    main()
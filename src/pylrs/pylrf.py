@@ -5,14 +5,17 @@
 
 import struct
 import zlib
-import StringIO
 import codecs
 import os
+import sys
+import array
 
 from pylrfopt import tagListOptimizer
 
 PYLRF_VERSION = "1.0"
 
+FILE_CHUNK_SIZE = 1 << 16
+
 #
 # Acknowledgement:
 #   This software would not have been possible without the pioneering
@@ -69,32 +72,58 @@ PYLRF_VERSION = "1.0"
 #   anyway.
 #
 
+# formats are compiled once, rather than parsed on every write
+BYTE = struct.Struct("<B")
+WORD = struct.Struct("<H")
+SIGNED_WORD = struct.Struct("<h")
+DWORD = struct.Struct("<I")
+QWORD = struct.Struct("<Q")
+COLOR = struct.Struct(">I")
+
+_structs = {}
+
+def getStruct(format):
+    try:
+        return _structs[format]
+    except KeyError:
+        _structs[format] = struct.Struct(format)
+        return _structs[format]
+
+
+class LrfBuffer(bytearray):
+    """ Gathers written data in memory, like a file. """
+    write = bytearray.extend
+
+
 def writeByte(f, byte):
-    f.write(struct.pack("<B", byte))
+    f.write(BYTE.pack(byte))
 
 def writeWord(f, word):
-    f.write(struct.pack("<H", int(word)))
+    f.write(WORD.pack(int(word)))
 
 def writeSignedWord(f, sword):
-    f.write(struct.pack("<h", int(sword)))
+    f.write(SIGNED_WORD.pack(int(sword)))
 
 def writeWords(f, *words):
-    f.write(struct.pack("<%dH" % len(words), *words))
+    f.write(getStruct("<%dH" % len(words)).pack(*words))
 
 def writeDWord(f, dword):
-    f.write(struct.pack("<I", int(dword)))
+    f.write(DWORD.pack(int(dword)))
 
 def writeDWords(f, *dwords):
-    f.write(struct.pack("<%dI" % len(dwords), *dwords))
+    f.write(getStruct("<%dI" % len(dwords)).pack(*dwords))
 
 def writeQWord(f, qword):
-    f.write(struct.pack("<Q", qword))
+    f.write(QWORD.pack(qword))
 
 def writeZeros(f, nZeros):
     f.write("\x00" * nZeros)
 
 def writeString(f, str):
-    f.write(str)
+    if isinstance(str, LrfFileData):
+        str.write(f)
+    else:
+        f.write(str)
 
 def writeIdList(f, idList):
     writeWord(f, len(idList))
@@ -103,7 +132,7 @@ def writeIdList(f, idList):
 def writeColor(f, color):
     # TODO: allow color names, web format
     color = int(color, 0)
-    f.write(struct.pack(">I", color))
+    f.write(COLOR.pack(color))
 
 def writeLineWidth(f, width):
     writeWord(f, int(width)//5)
@@ -329,27 +358,14 @@ class LrfError(Exception):
 
 
 
-class ObjectTableEntry(object):
-    def __init__(self, objId, offset, size):
-        self.objId = objId
-        self.offset = offset
-        self.size = size
-
-    def write(self, f):
-        writeDWords(f, self.objId, self.offset, self.size, 0)
-
-
-
 class LrfTag(object):
+    __slots__ = ("name", "parameter")
+
     def __init__(self, name, *parameters):
-        try:
-            tagInfo = TAG_INFO[name]
-        except KeyError:
+        if name not in TAG_INFO:
             raise LrfError, "tag name %s not recognized" % name
 
         self.name = name
-        self.type = tagInfo[0]
-        self.format = tagInfo[1:]
 
         if len(parameters) > 1:
             raise LrfError("only one parameter allowed on tag %s" % name)
@@ -360,30 +376,155 @@ class LrfTag(object):
             self.parameter = parameters[0]
 
 
-    def write(self, lrf, encoding=None):
-        if self.type != 0:
-            writeWord(lrf, self.type)
+    # the type and format are looked up, rather than kept on every tag
+    type = property(lambda self: TAG_INFO[self.name][0])
+    format = property(lambda self: TAG_INFO[self.name][1:])
 
-        p = self.parameter
-        if p is None:
-            return
 
+    def write(self, lrf, encoding=None):
         #print "   Writing tag", self.name
-        for f in self.format:
-            if isinstance(f, dict):
-                p = f[p]
-            elif isinstance(f, str):
+        TAG_ENCODERS[self.name](lrf, self.parameter, encoding)
+
+
+
+# writers of a single fixed size value, which are packed along with the tag
+FIXED_WRITERS = {writeWord: ("H", int), writeSignedWord: ("h", int),
+                 writeDWord: ("I", int)}
+
+# writers which need the source encoding
+ENCODED_WRITERS = [writeUnicode, writeRaw, writeEmpDots]
+
+def makeTagEncoder(name):
+    """
+        Resolve the format of a tag in TAG_INFO into a function
+        encode(f, parameter, encoding) which writes the tag.  Fixed size
+        values are packed together with the tag type, in a single struct.
+    """
+    tagInfo = TAG_INFO[name]
+    tagType = tagInfo[0]
+    format = tagInfo[1:]
+
+    header = ""
+    if tagType != 0:
+        header = WORD.pack(tagType)
+
+    mapping = None
+    if format and isinstance(format[0], dict):
+        mapping = format[0]
+        format = format[1:]
+
+    if len(format) > 1:
+        raise LrfError, "tag format of %s not supported" % name
+
+    if not format:
+        def encode(f, p, encoding):
+            f.write(header)
+
+    elif tagType != 0 and isinstance(format[0], str):
+        packer = struct.Struct("<H" + format[0].lstrip("<"))
+        def encode(f, p, encoding):
+            if p is None:
+                f.write(header)
+                return
+            if mapping is not None:
+                p = mapping[p]
+            if isinstance(p, tuple):
+                f.write(packer.pack(tagType, *p))
+            else:
+                f.write(packer.pack(tagType, p))
+
+    elif tagType != 0 and format[0] in FIXED_WRITERS:
+        valueFormat, convert = FIXED_WRITERS[format[0]]
+        packer = struct.Struct("<H" + valueFormat)
+        def encode(f, p, encoding):
+            if p is None:
+                f.write(header)
+                return
+            if mapping is not None:
+                p = mapping[p]
+            f.write(packer.pack(tagType, convert(p)))
+
+    else:
+        writer = format[0]
+        needsEncoding = writer in ENCODED_WRITERS
+        if isinstance(writer, str):
+            packer = struct.Struct(writer)
+            def writer(f, p):
                 if isinstance(p, tuple):
-                    writeString(lrf, struct.pack(f, *p))
+                    f.write(packer.pack(*p))
                 else:
-                    writeString(lrf, struct.pack(f, p))
+                    f.write(packer.pack(p))
+
+        def encode(f, p, encoding):
+            f.write(header)
+            if p is None:
+                return
+            if mapping is not None:
+                p = mapping[p]
+            if needsEncoding:
+                if encoding is None:
+                    raise LrfError, "Tag requires encoding"
+                writer(f, p, encoding)
             else:
-                if f in [writeUnicode, writeRaw, writeEmpDots]:
-                    if encoding is None:
-                        raise LrfError, "Tag requires encoding"
-                    f(lrf, p, encoding)
-                else:
-                    f(lrf, p)
+                writer(f, p)
+
+    return encode
+
+
+TAG_ENCODERS = dict([(name, makeTagEncoder(name)) for name in TAG_INFO])
+
+
+class LrfFileData(object):
+    """
+        The contents of a file, to be written as stream data.  The file is
+        only read when written, and then copied in chunks, so it is never
+        held in memory whole.  Either a filename or an open file-like object
+        (which is read from its start) may be given.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        if hasattr(filename, "read"):
+            filename.seek(0, 2)
+            self.size = filename.tell()
+        else:
+            self.size = os.path.getsize(filename)
+
+
+    def __len__(self):
+        return self.size
+
+
+    def open(self):
+        if hasattr(self.filename, "read"):
+            self.filename.seek(0)
+            return self.filename
+
+        return file(self.filename, "rb")
+
+
+    def close(self, f):
+        if f is not self.filename:
+            f.close()
+
+
+    def read(self):
+        f = self.open()
+        data = f.read(self.size)
+        self.close(f)
+        return data
+
+
+    def write(self, lrf):
+        f = self.open()
+        remaining = self.size
+        while remaining > 0:
+            data = f.read(min(remaining, FILE_CHUNK_SIZE))
+            if not data:
+                raise LrfError, "stream data ended early"
+            lrf.write(data)
+            remaining -= len(data)
+        self.close(f)
+
 
 
 STREAM_SCRAMBLED = 0x200
@@ -422,6 +563,8 @@ class LrfStreamBase(object):
             optimize = False
 
         if flags & STREAM_COMPRESSED == STREAM_COMPRESSED:
+            if isinstance(streamBuffer, LrfFileData):
+                streamBuffer = streamBuffer.read()
             uncompLen = len(streamBuffer)
             compStreamBuffer = zlib.compress(streamBuffer)
             if optimize and uncompLen <= len(compStreamBuffer) + 4:
@@ -451,29 +594,29 @@ class LrfTagStream(LrfStreamBase):
 
     def getStreamTags(self, encoding,
             optimizeTags=False, optimizeCompression=False):
-        stream = StringIO.StringIO()
-        if optimizeTags:
+        stream = LrfBuffer()
+        if optimizeTags is True:
             tagListOptimizer(self.tags)
+        elif optimizeTags:
+            tagListOptimizer(self.tags, optimizeTags)
             
         for tag in self.tags:
-            tag.write(stream, encoding)
+            TAG_ENCODERS[tag.name](stream, tag.parameter, encoding)
 
-        self.streamData = stream.getvalue()
-        stream.close()
+        self.streamData = str(stream)
         return LrfStreamBase.getStreamTags(self, optimize=optimizeCompression)
 
 
 
 class LrfFileStream(LrfStreamBase):
     def __init__(self, streamFlags, filename):
-        LrfStreamBase.__init__(self, streamFlags)
-        f = file(filename, "rb")
-        self.streamData = f.read()
-        f.close()
+        LrfStreamBase.__init__(self, streamFlags, LrfFileData(filename))
 
 
 
 class LrfObject(object):
+    __slots__ = ("name", "objId", "tags", "type")
+
     def __init__(self, name, objId):
         if objId <= 0:
             raise LrfError, "invalid objId for " + name
@@ -539,12 +682,21 @@ class LrfObject(object):
 
     def write(self, lrf, encoding=None):
         #print "Writing object", self.name
-        LrfTag("ObjectStart", (self.objId, self.type)).write(lrf)
+        # the object is gathered in memory, and written in one go
+        buffer = LrfBuffer()
+        TAG_ENCODERS["ObjectStart"](buffer, (self.objId, self.type), None)
         
         for tag in self.tags:
-            tag.write(lrf, encoding)
+            if isinstance(tag.parameter, LrfFileData):
+                # copied from its file straight after what comes before it
+                lrf.write(str(buffer))
+                del buffer[:]
+                tag.write(lrf, encoding)
+            else:
+                TAG_ENCODERS[tag.name](buffer, tag.parameter, encoding)
 
-        LrfTag("ObjectEnd").write(lrf)
+        TAG_ENCODERS["ObjectEnd"](buffer, None, None)
+        lrf.write(str(buffer))
 
 
 
@@ -565,7 +717,7 @@ class LrfToc(LrfObject):
 
 
     def _makeTocStream(self, toc, se):
-        stream = StringIO.StringIO()
+        stream = LrfBuffer()
         nEntries = len(toc)
 
         writeDWord(stream, nEntries)
@@ -589,9 +741,7 @@ class LrfToc(LrfObject):
             writeDWord(stream, objId)
             writeUnicode(stream, label, se)
 
-        streamData = stream.getvalue()
-        stream.close()
-        return streamData
+        return str(stream)
 
         
 
@@ -607,7 +757,8 @@ class LrfWriter(object):
 
         self.saveStreamTags = False # used only in testing -- hogs memory
 
-        # highly experimental -- set to True at your own risk
+        # highly experimental -- set to True (or a list of the text
+        # setting tags to remove when redundant) at your own risk
         self.optimizeTags = False
         self.optimizeCompression = False
 
@@ -625,7 +776,14 @@ class LrfWriter(object):
         self.thumbnailEncoding = "JPEG"
         self.thumbnailData = ""
         self.objects = []
-        self.objectTable = []
+
+        # objId, offset, size and a zero for each object written
+        self.objectTable = array.array("I")
+
+        # when writing incrementally, the file objects are written to, and
+        # whether its header has been written yet
+        self.lrf = None
+        self.headerWritten = False
 
 
     def getSourceEncoding(self):
@@ -696,12 +854,52 @@ class LrfWriter(object):
         pass
 
 
+    def beginFile(self, lrf):
+        """
+            Write incrementally: objects appended from now on are written
+            to lrf at each flush, keeping only their object table entries.
+            writeFile must then be called with the same file.
+        """
+        self.lrf = lrf
+
+
+    def flush(self):
+        """
+            Write the objects appended so far, when writing incrementally.
+            Only call this when none of them will be changed any more.  The
+            root object is kept back, as fonts are still registered on it.
+        """
+        if self.lrf is None:
+            return
+
+        if not self.headerWritten:
+            self.writeHeader(self.lrf)
+            self.headerWritten = True
+
+        pending = []
+        for obj in self.objects:
+            if obj is self.rootObj:
+                pending.append(obj)
+            else:
+                self.writeObject(self.lrf, obj)
+
+        self.objects = pending
+
+
     def writeFile(self, lrf):
         if self.rootObjId == 0:
             raise LrfError, "no root object has been set"
 
-        self.writeHeader(lrf)
-        self.writeObjects(lrf)
+        if self.lrf is not None:
+            self.flush()
+            for obj in self.objects:
+                self.writeObject(lrf, obj)
+            self.objects = []
+            self.updateHeader(lrf)
+        else:
+            self.writeHeader(lrf)
+            self.writeObjects(lrf)
+
         self.updateObjectTableOffset(lrf)
         self.updateTocObjectOffset(lrf)
         self.writeObjectTable(lrf)
@@ -712,7 +910,7 @@ class LrfWriter(object):
         writeWord(lrf, LRF_VERSION)
         writeWord(lrf, XOR_KEY)
         writeDWord(lrf, self.rootObjId)
-        writeQWord(lrf, len(self.objects))
+        writeQWord(lrf, len(self.objects) + len(self.objectTable) // 4)
         writeQWord(lrf, 0) # 0x18 objectTableOffset -- will be updated
         writeZeros(lrf, 4) # 0x20 unknown
         writeWord(lrf, self.binding)
@@ -733,13 +931,24 @@ class LrfWriter(object):
 
     def writeObjects(self, lrf):
         # also appends object entries to the object table
-        self.objectTable = []
+        self.objectTable = array.array("I")
         for obj in self.objects:
-            objStart = lrf.tell()
-            obj.write(lrf, self.sourceEncoding)
-            objEnd = lrf.tell()
-            self.objectTable.append(
-                    ObjectTableEntry(obj.objId, objStart, objEnd-objStart))
+            self.writeObject(lrf, obj)
+
+
+    def writeObject(self, lrf, obj):
+        objStart = lrf.tell()
+        obj.write(lrf, self.sourceEncoding)
+        objEnd = lrf.tell()
+        self.objectTable.extend((obj.objId, objStart, objEnd-objStart, 0))
+
+
+    def updateHeader(self, lrf):
+        # the root object and object count are only known at the end
+        lrf.seek(0x0C, 0)
+        writeDWord(lrf, self.rootObjId)
+        writeQWord(lrf, len(self.objectTable) // 4)
+        lrf.seek(0, 2)
 
 
     def updateObjectTableOffset(self, lrf):
@@ -754,10 +963,11 @@ class LrfWriter(object):
         if self.tocObjId == 0:
             return
 
-        for entry in self.objectTable:
-            if entry.objId == self.tocObjId:
+        table = self.objectTable
+        for i in range(0, len(table), 4):
+            if table[i] == self.tocObjId:
                 lrf.seek(0x48, 0)
-                writeDWord(lrf, entry.offset)
+                writeDWord(lrf, table[i+1])
                 lrf.seek(0, 2)
                 break
         else:
@@ -765,6 +975,9 @@ class LrfWriter(object):
 
 
     def writeObjectTable(self, lrf):
-        for tableEntry in self.objectTable:
-            tableEntry.write(lrf)
+        table = self.objectTable
+        if sys.byteorder != "little":
+            table = array.array("I", table)
+            table.byteswap()
+        lrf.write(table.tostring())
 
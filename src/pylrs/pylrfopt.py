@@ -1,33 +1,80 @@
-def _optimize(tagList, tagName, conversion):
-    # copy the tag of interest plus any text
-    newTagList = []
-    for tag in tagList:
-        if tag.name == tagName or tag.name == "rawtext":
-            newTagList.append(tag)
-
-    # now, eliminate any duplicates (leaving the last one)
-    for i, newTag in enumerate(newTagList[:-1]):
-        if newTag.name == tagName and newTagList[i+1].name == tagName:
-            tagList.remove(newTag)
-
-    # eliminate redundant settings to same value across text strings
-    newTagList = []
-    for tag in tagList:
-        if tag.name == tagName:
-            newTagList.append(tag)
-
-    for i, newTag in enumerate(newTagList[:-1]):
-        value = conversion(newTag.parameter)
-        nextValue = conversion(newTagList[i+1].parameter)
-        if value == nextValue:
-            tagList.remove(newTagList[i+1])
-
-    # eliminate any setting that don't have text after them
-    while len(tagList) > 0 and tagList[-1].name == tagName:
-        del tagList[-1]
-
-
-def tagListOptimizer(tagList):
+def _color(value):
+    return int(value, 0)
+
+
+def _same(value):
+    return value
+
+
+# the text setting tags which are optimized, in the order they are handled,
+# each with the conversion used to compare their values
+OPTIMIZED_TAGS = [("fontsize", int), ("fontweight", int)]
+
+# every text setting tag which the optimizer can safely handle
+TEXT_SETTING_TAGS = OPTIMIZED_TAGS + [
+        ("fontwidth", int), ("fontescapement", int), ("fontorientation", int),
+        ("fontfacename", _same), ("textcolor", _color), ("textbgcolor", _color),
+        ("wordspace", int), ("letterspace", int), ("baselineskip", int),
+        ("linespace", int), ("charspace", int)]
+
+
+def _optimize(tagList, tags):
+    # removed[i] is the number of the pass which removes tag i, pass k
+    # handling the k-th of the tags; a tag removed by a later pass is still
+    # present while an earlier one runs
+    n = len(tagList)
+    removed = [0] * n
+    passes = {}
+    for k, (tagName, conversion) in enumerate(tags):
+        passes[tagName] = (k + 1, conversion)
+
+    # per tag name: the setting waiting for the next text or setting, and
+    # the value of the last setting which survived that
+    pending = {}
+    lastValue = {}
+
+    def settle(tagName, i):
+        # a setting followed by text keeps its place, unless it only
+        # repeats the value of the setting before it
+        k, conversion = passes[tagName]
+        value = conversion(tagList[i].parameter)
+        if tagName in lastValue and lastValue[tagName] == value:
+            removed[i] = k
+        lastValue[tagName] = value
+
+    for i in xrange(n):
+        tagName = tagList[i].name
+        if tagName == "rawtext":
+            for name, j in pending.iteritems():
+                settle(name, j)
+            pending.clear()
+        elif tagName in passes:
+            # a setting changed again before any text is dropped
+            if tagName in pending:
+                removed[pending[tagName]] = passes[tagName][0]
+            pending[tagName] = i
+
+    for name, j in pending.iteritems():
+        settle(name, j)
+
+    # eliminate any setting that doesn't have text after it, in the same
+    # order as the passes
+    for k, (tagName, conversion) in enumerate(tags):
+        k += 1
+        i = n - 1
+        while i >= 0:
+            if removed[i] and removed[i] <= k:
+                i -= 1
+            elif tagList[i].name == tagName:
+                removed[i] = k
+                i -= 1
+            else:
+                break
+
+    tagList[:] = [tag for tag, r in zip(tagList, removed) if not r]
+
+
+def tagListOptimizer(tagList, tags=OPTIMIZED_TAGS):
     # this function eliminates redundant or unnecessary tags
     # it scans a list of tags, looking for text settings that are
     # changed before any text is output
@@ -35,9 +82,9 @@ def tagListOptimizer(tagList):
     #  fontsize=100, fontsize=200, text, fontsize=100, fontsize=200
     # should be:
     # fontsize=200 text
+    #
+    # all the tags are handled in a single scan, so the time taken grows
+    # linearly with the length of the list
     oldSize = len(tagList)
-    _optimize(tagList, "fontsize", int)
-    _optimize(tagList, "fontweight", int)
+    _optimize(tagList, tags)
     return oldSize - len(tagList)
-
-
@@ -16,7 +16,7 @@ from elements import ElementWriter
 from pylrf import (LrfWriter, LrfObject, LrfTag, LrfToc,
         STREAM_COMPRESSED, LrfTagStream, LrfStreamBase, IMAGE_TYPE_ENCODING,
         BINDING_DIRECTION_ENCODING, LINE_TYPE_ENCODING, LrfFileStream,
-        STREAM_FORCE_COMPRESSED)
+        LrfFileData, STREAM_FORCE_COMPRESSED)
 
 PYLRS_VERSION = "1.0.1"
 
@@ -253,6 +253,8 @@ class Delegator(object):
 
 class LrsAttributes(object):
     """ A mixin class to handle default and user supplied attributes. """
+    __slots__ = ()
+
     def __init__(self, defaults, alsoAllow=None, **settings):
         if alsoAllow is None:
             alsoAllow = []
@@ -270,6 +272,8 @@ class LrsContainer(object):
     """ This class is a mixin class for elements that are contained in or
         contain an unknown number of other elements.
     """
+    __slots__ = ()
+
     def __init__(self, validChildren):
         self.parent = None
         self.contents = []
@@ -316,6 +320,7 @@ class LrsContainer(object):
 
 class LrsObject(object):
     """ A mixin class for elements that need an object id. """
+    __slots__ = ()
     NextObjId = 0
  
     @classmethod
@@ -391,6 +396,12 @@ class Book(Delegator):
 
         setdefault=SetDefault()
         Override the defalut SetDefault.
+
+        optimizeTags=True or optimizeTags=[(tag name, conversion), ...]
+        Remove text settings which are changed again before any text, or
+        which repeat the current value.  True handles the font size and
+        weight, pylrfopt.TEXT_SETTING_TAGS every text setting.  Highly
+        experimental.
         
         There are several other settings -- see the BookInfo class for more.       
     """
@@ -461,13 +472,21 @@ class Book(Delegator):
         lrsFile.close()
 
 
-    def renderLrf(self, lrfFilename):
+    def renderLrf(self, lrfFilename, incremental=False):
+        """
+            Write the book as an LRF to the file lrfFilename.  With
+            incremental=True, pages and objects are written out as soon as
+            they are converted, rather than all held until the end, so that
+            memory use does not grow with the length of the book.
+        """
         self.appendReferencedObjects(self)
         lrfFile = file(lrfFilename, "wb")
         lrfWriter = LrfWriter(self.sourceencoding)
 
         lrfWriter.optimizeTags = self.optimizeTags
         lrfWriter.optimizeCompression = self.optimizeCompression
+        if incremental:
+            lrfWriter.beginFile(lrfFile)
 
         self.toLrf(lrfWriter)
         lrfWriter.writeFile(lrfFile)
@@ -775,6 +794,7 @@ class Main(LrsContainer):
         for p in self.contents:
             pageIds.append(p.objId)
             p.toLrf(lrfWriter)
+            lrfWriter.flush()
 
         # create a page tree object
 
@@ -1196,6 +1216,10 @@ class Page(LrsObject, LrsContainer):
         Pages are added to Books.  Pages can be supplied a PageStyle.
         If they are not, Page.defaultPageStyle will be used.
     """
+    # there are many pages in a long book, so they are kept compact
+    __slots__ = ("objId", "parent", "contents", "validChildren",
+                 "pageStyle", "settings", "stream")
+
     defaultPageStyle = PageStyle()
 
     def __init__(self, *args, **settings):
@@ -1826,6 +1850,7 @@ class Objects(LrsContainer):
     def toLrf(self, lrfWriter):
         for content in self.contents:
             content.toLrf(lrfWriter)
+            lrfWriter.flush()
     
 
 class JumpButton(LrsObject, LrsContainer):
@@ -1972,18 +1997,35 @@ class PutObj(LrsContainer):
 class ImageStream(LrsObject, LrsContainer):
     """ 
         Embed an image file into an Lrf. 
+
+        The image can be given as a filename, an open file-like object, or
+        its encoded bytes through data=.  Images which do not come from a
+        named file have their encoding found from their contents when it is
+        not specified, and can only be rendered to an Lrf.
     """
     
+    __slots__ = ("objId", "parent", "contents", "validChildren",
+                 "filename", "data", "comment", "encoding")
+
     VALID_ENCODINGS = [ "JPEG", "GIF", "BMP", "PNG" ]
+
+    SIGNATURES = [ ("\x89PNG", "PNG"), ("\xff\xd8", "JPEG"), ("GIF8", "GIF"),
+                   ("BM", "BMP") ]
     
-    def __init__(self, filename, encoding=None, comment=None):
+    def __init__(self, filename=None, encoding=None, comment=None, data=None):
         LrsObject.__init__(self)
         LrsContainer.__init__(self, [])
-        _checkExists(filename)
+        if (filename is None) == (data is None):
+            raise LrsError, "ImageStream needs either a file or data"
+
+        if data is None and not hasattr(filename, "read"):
+            _checkExists(filename)
         self.filename = filename
+        self.data = data
         self.comment = comment
         # TODO: move encoding from extension to lrf module
-        if encoding is None:
+        if encoding is None and data is None and \
+                not hasattr(filename, "read"):
             extension = os.path.splitext(filename)[1]
             if not extension:
                 raise LrsError, \
@@ -1994,6 +2036,8 @@ class ImageStream(LrsObject, LrsContainer):
                 extension = "JPEG"
                 
             encoding = extension
+        elif encoding is None:
+            encoding = self.sniffEncoding()
         else:
             encoding = encoding.upper()
             
@@ -2002,12 +2046,28 @@ class ImageStream(LrsObject, LrsContainer):
                 "encoding or file extension not JPEG, GIF, BMP, or PNG"
         
         self.encoding = encoding
+
+
+    def sniffEncoding(self):
+        if self.data is not None:
+            header = self.data[:4]
+        else:
+            self.filename.seek(0)
+            header = self.filename.read(4)
+
+        for signature, encoding in self.SIGNATURES:
+            if header.startswith(signature):
+                return encoding
+
+        raise LrsError, "image data not JPEG, GIF, BMP, or PNG"
         
 
     def toLrf(self, lrfWriter):
-        imageFile = file(self.filename, "rb")
-        imageData = imageFile.read()
-        imageFile.close()
+        # a file is copied from when the object is written
+        if self.data is not None:
+            imageData = self.data
+        else:
+            imageData = LrfFileData(self.filename)
 
         isObj = LrfObject("ImageStream", self.objId)
         if self.comment is not None:
@@ -2020,6 +2080,9 @@ class ImageStream(LrsObject, LrsContainer):
 
 
     def toElement(self, se):
+        if self.data is not None or hasattr(self.filename, "read"):
+            raise LrsError, "an LRS can only refer to image files"
+
         element = self.lrsObjectElement("ImageStream",
                                 objlabel="imagestreamlabel",
                                 encoding=self.encoding, file=self.filename)
@@ -2032,6 +2095,10 @@ class ImageBlock(LrsObject, LrsContainer, LrsAttributes):
     """ Create an image on a page. """
     # TODO: allow other block attributes
 
+    __slots__ = ("objId", "parent", "contents", "validChildren", "attrs",
+                 "x0", "y0", "x1", "y1", "xsize", "ysize", "refstream",
+                 "blockStyle", "alttext", "extraId", "tocLabel")
+
     defaults = dict(blockwidth="600", blockheight="800") 
 
     def __init__(self, refstream, x0="0", y0="0", x1="600", y1="800", 
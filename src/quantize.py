@@ -0,0 +1,285 @@
+## Copyright (c) 2007 Ashish Kulkarni
+##
+## Permission is hereby granted, free of charge, to any person obtaining a
+## copy of this software and associated documentation files (the "Software"),
+## to deal in the Software without restriction, including without limitation
+## the rights to use, copy, modify, merge, publish, distribute, sublicense,
+## and/or sell copies of the Software, and to permit persons to whom the
+## Software is furnished to do so, subject to the following conditions:
+##
+## The above copyright notice and this permission notice shall be included in
+## all copies or substantial portions of the Software.
+##
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+## IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+## FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+## AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+## LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+## FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+## DEALINGS IN THE SOFTWARE.
+
+
+import os, zlib, struct, Image, ImageChops
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+from common import *
+
+########################################################### CONSTANTS
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+PNG_LEVEL     = 9
+
+""" the 8x8 Bayer matrix, with thresholds from 0 to 63 """
+def bayer_matrix(n=8):
+  if n == 1:
+    return [[0]]
+  half = bayer_matrix(n / 2)
+  return [ [ 4*half[y % (n/2)][x % (n/2)] + [[0, 2], [3, 1]][y / (n/2)][x / (n/2)]
+             for x in range(n) ] for y in range(n) ]
+
+BAYER = bayer_matrix()
+
+########################################################### QUANTIZING
+
+""" the number of levels and PNG bit depth used for a count of colors """
+def gray_depth(colors):
+  for bits in (1, 2, 4, 8):
+    if colors <= 1 << bits:
+      return bits
+  return 8
+
+""" quantize a grayscale image to evenly spaced levels, returning an image
+    whose pixels are the level numbers from 0 to colors-1 """
+def quantize(image, colors, dither='none'):
+  colors = max(2, min(256, colors))
+  steps  = colors - 1
+  image  = image.convert('L')
+
+  if dither == 'fs':
+    # let PIL's palette conversion do the error diffusion
+    palette = Image.new('P', (1, 1))
+    levels  = [ (i * 255 + steps / 2) / steps for i in range(colors) ]
+    palette.putpalette(reduce(lambda a, b: a + [b]*3, levels, []) +
+                       [levels[-1]] * 3 * (256 - colors))
+    indexed = image.convert('RGB').quantize(palette=palette)
+    return Image.fromstring('L', image.size, indexed.tostring()) \
+                .point([ min(i, steps) for i in range(256) ])
+
+  if dither == 'ordered':
+    # raise every pixel by a threshold from the tiled Bayer matrix, just
+    # below one level step, then round down
+    w, h = image.size
+    tile = Image.new('L', (8, 8))
+    tile.putdata([ int((BAYER[y][x] + 0.5) / 64 * 255 / steps)
+                   for y in range(8) for x in range(8) ])
+    thresholds = Image.new('L', image.size)
+    for y in range(0, h, 8):
+      for x in range(0, w, 8):
+        thresholds.paste(tile, (x, y))
+    image = ImageChops.add(image, thresholds)
+    return image.point([ i * steps / 255 for i in range(256) ])
+
+  return image.point([ (i * steps + 127) / 255 for i in range(256) ])
+
+########################################################### PNG WRITER
+
+""" pack the level numbers of a quantized image into PNG scanlines, each
+    preceded by its filter type byte """
+def pack_rows(levels, bits):
+  w, h = levels.size
+  data = levels.tostring()
+  if bits == 8:
+    return ''.join([ '\0' + data[y*w:(y+1)*w] for y in range(h) ])
+
+  per = 8 / bits
+  if numpy is not None:
+    pixels = numpy.fromstring(data, numpy.uint8).reshape((h, w))
+    padded = numpy.zeros((h, (w + per - 1) / per * per), numpy.uint8)
+    padded[:, :w] = pixels
+    padded = padded.reshape((h, -1, per))
+    packed = numpy.zeros((h, padded.shape[1] + 1), numpy.uint8)
+    for k in range(per):
+      packed[:, 1:] |= padded[:, :, k] << (8 - bits * (k + 1))
+    return packed.tostring()
+
+  rows = []
+  for y in range(h):
+    row    = bytearray(data[y*w:(y+1)*w] + '\0' * (per - 1))
+    packed = bytearray((w + per - 1) / per + 1)
+    for x in range(w):
+      packed[x / per + 1] |= row[x] << (8 - bits * (x % per + 1))
+    rows.append(str(packed))
+  return ''.join(rows)
+
+""" a PNG chunk """
+def png_chunk(kind, data):
+  return struct.pack('>I', len(data)) + kind + data + \
+         struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+""" write a quantized image as a grayscale PNG at the lowest bit depth which
+    holds its levels, to a file name or a file object """
+def write_gray_png(filename, levels, colors):
+  bits  = gray_depth(colors)
+  steps = colors - 1
+  if (1 << bits) != colors:
+    # levels which do not fill a bit depth are stored as 8-bit gray values
+    levels, bits = levels.point([ (i * 255 + steps / 2) / max(1, steps)
+                                  for i in range(256) ]), 8
+
+  w, h   = levels.size
+  header = struct.pack('>IIBBBBB', w, h, bits, 0, 0, 0, 0)
+  data   = zlib.compress(pack_rows(levels, bits), PNG_LEVEL)
+
+  data = PNG_SIGNATURE + png_chunk('IHDR', header) + \
+         png_chunk('IDAT', data) + png_chunk('IEND', '')
+  if hasattr(filename, 'write'):
+    filename.write(data)
+  else:
+    write_file(filename, data)
+
+########################################################### PNG OPTIMIZER
+
+## zlib strategies tried when recompressing; Z_RLE is missing from older
+## versions of the zlib module, but is understood by the library itself
+STRATEGIES = [zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_HUFFMAN_ONLY,
+              getattr(zlib, 'Z_RLE', 3)]
+
+## image modes which can be rewritten, as (color type, bit depth) to
+## (mode, bytes per complete pixel)
+PNG_MODES = {
+  (0, 1): ('1',    1), (0, 2): ('L', 1), (0, 4): ('L', 1), (0, 8): ('L', 1),
+  (3, 1): ('P',    1), (3, 2): ('P', 1), (3, 4): ('P', 1), (3, 8): ('P', 1),
+  (2, 8): ('RGB',  3), (4, 8): ('LA', 2), (6, 8): ('RGBA', 4)
+}
+
+""" split PNG data into its (type, data) chunks """
+def png_chunks(data):
+  chunks = []
+  offset = len(PNG_SIGNATURE)
+  while offset + 8 <= len(data):
+    length, kind = struct.unpack('>I4s', data[offset:offset+8])
+    chunks.append( (kind, data[offset+8:offset+8+length]) )
+    offset += length + 12
+  return chunks
+
+""" the unfiltered scanlines of a decoded PNG image, one row per line of a
+    2-dimensional array """
+def png_rows(image, kind, bits):
+  w, h = image.size
+  if bits == 8:
+    data = image.tostring()
+  else:
+    # bring gray values back to their levels, and pack them like the writer
+    if kind == 0:
+      steps = (1 << bits) - 1
+      image = image.convert('L').point([ i * steps / 255 for i in range(256) ])
+    data = pack_rows(Image.fromstring('L', (w, h), image.tostring()), bits)
+    data = numpy.fromstring(data, numpy.uint8).reshape((h, -1))[:, 1:]
+    return numpy.ascontiguousarray(data)
+
+  return numpy.fromstring(data, numpy.uint8).reshape((h, -1))
+
+""" every PNG filter type applied to all the rows, in order """
+def png_filters(rows, bpp):
+  rows  = rows.astype(numpy.int16)
+  left  = numpy.zeros_like(rows)
+  left[:, bpp:] = rows[:, :-bpp]
+  up    = numpy.zeros_like(rows)
+  up[1:] = rows[:-1]
+  corner = numpy.zeros_like(rows)
+  corner[1:, bpp:] = rows[:-1, :-bpp]
+
+  base  = left + up - corner
+  da, db, dc = abs(base - left), abs(base - up), abs(base - corner)
+  paeth = numpy.where((da <= db) & (da <= dc), left,
+                      numpy.where(db <= dc, up, corner))
+
+  return [ (rows - predictor).astype(numpy.uint8)
+           for predictor in (0, left, up, (left + up) >> 1, paeth) ]
+
+""" the candidate filtered scanlines for some rows: every single filter
+    type, and the per row choice with the smallest sum of differences """
+def png_candidates(rows, bpp):
+  filtered = png_filters(rows, bpp)
+  costs    = numpy.array([ abs(f.view(numpy.int8).astype(numpy.int32)).sum(axis=1)
+                           for f in filtered ])
+  best     = costs.argmin(axis=0)
+  adaptive = numpy.choose(best[:, None], filtered)
+  filtered.append(adaptive)
+
+  candidates = []
+  for types, data in zip(range(5) + [best], filtered):
+    column = numpy.empty((data.shape[0], 1), numpy.uint8)
+    column[:, 0] = types
+    candidates.append(numpy.hstack((column, data)).tostring())
+  return candidates
+
+""" recompress a PNG file in place, trying each filter type and zlib
+    strategy and keeping the smallest result; the file is left alone if it
+    can not be read or made smaller """
+def optimize_png(filename):
+  data   = read_file(filename)
+  chunks = png_chunks(data)
+  if not chunks or chunks[0][0] != 'IHDR':
+    return False
+
+  w, h, bits, kind, compression, filter, interlace = \
+    struct.unpack('>IIBBBBB', chunks[0][1])
+  if (kind, bits) not in PNG_MODES or interlace:
+    return False
+
+  image = Image.open(filename)
+  mode, bpp = PNG_MODES[(kind, bits)]
+  if image.mode != mode and not (kind == 0 and bits < 8):
+    return False
+
+  if numpy is not None:
+    candidates = png_candidates(png_rows(image, kind, bits), bpp)
+  else:
+    # without numpy, only the unfiltered scanlines are tried
+    if bits == 8:
+      raw = image.tostring()
+      stride = w * bpp
+      candidates = [ ''.join([ '\0' + raw[y*stride:(y+1)*stride]
+                               for y in range(h) ]) ]
+    elif kind == 0:
+      steps = (1 << bits) - 1
+      candidates = [ pack_rows(image.convert('L').point([ i * steps / 255
+                                                          for i in range(256) ]),
+                               bits) ]
+    else:
+      candidates = [ pack_rows(Image.fromstring('L', (w, h), image.tostring()),
+                               bits) ]
+
+  best = ''.join([ chunk for kind_, chunk in chunks if kind_ == 'IDAT' ])
+  for scanlines in candidates:
+    for strategy in STRATEGIES:
+      compressor = zlib.compressobj(PNG_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS,
+                                    9, strategy)
+      compressed = compressor.compress(scanlines) + compressor.flush()
+      if len(compressed) < len(best):
+        best = compressed
+
+  # keep every other chunk, with the image data in place of the first IDAT
+  output = [PNG_SIGNATURE]
+  for kind_, chunk in chunks:
+    if kind_ != 'IDAT':
+      output.append( png_chunk(kind_, chunk) )
+    elif best is not None:
+      output.append( png_chunk('IDAT', best) )
+      best = None
+
+  output = ''.join(output)
+  if len(output) >= len(data):
+    return False
+
+  # replace the file in one step, so it is never seen half written
+  write_file(filename + '.tmp', output)
+  if os.path.exists(filename):
+    os.remove(filename)
+  os.rename(filename + '.tmp', filename)
+  return True
@@ -0,0 +1,115 @@
+## Copyright (c) 2007 Ashish Kulkarni
+##
+## Permission is hereby granted, free of charge, to any person obtaining a
+## copy of this software and associated documentation files (the "Software"),
+## to deal in the Software without restriction, including without limitation
+## the rights to use, copy, modify, merge, publish, distribute, sublicense,
+## and/or sell copies of the Software, and to permit persons to whom the
+## Software is furnished to do so, subject to the following conditions:
+##
+## The above copyright notice and this permission notice shall be included in
+## all copies or substantial portions of the Software.
+##
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+## IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+## FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+## AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+## LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+## FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+## DEALINGS IN THE SOFTWARE.
+
+
+import os, sys, random, unittest, Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+from common  import *
+from process import PortraitMode, LandscapeMode
+from pdfread import process_image
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+""" a page of lines of words in several shades, with a few rules and some
+    noise, drawn the same every time; the bands of an RGB page differ """
+def fixture_page(mode='L', size=(425, 550)):
+  rnd   = random.Random(17)
+  image = Image.new('L', size, 255)
+  draw  = ImageDraw.Draw(image)
+  w, h  = size
+
+  for y in range(40, h - 40, 14):
+    x = 30
+    while x < w - 60:
+      length = rnd.randint(8, 50)
+      draw.rectangle((x, y, x + length, y + rnd.randint(1, 6)),
+                     fill=rnd.randint(0, 96))
+      x += length + rnd.randint(3, 9)
+
+  draw.line((20, 25, w - 20, 25), fill=0)
+  draw.line((w / 2, h - 30, w / 2, h - 10), fill=0)
+  for i in range(300):
+    image.putpixel((rnd.randrange(w), rnd.randrange(h)), rnd.randint(0, 255))
+
+  if mode == 'RGB':
+    image = Image.merge('RGB', (image,
+                                image.transpose(Image.FLIP_LEFT_RIGHT),
+                                image.transpose(Image.FLIP_TOP_BOTTOM)))
+  return image
+
+""" the numpy filters must give exactly the pixels of the PIL ones """
+class NumericTest(unittest.TestCase):
+
+  def setUp(self):
+    silence()
+    if numpy is None:
+      self.skipTest('NumPy is not installed')
+
+  def assertSameImage(self, first, second):
+    self.assertEqual(first.mode, second.mode)
+    self.assertEqual(first.size, second.size)
+    self.assertTrue(first.tostring() == second.tostring())
+
+  def test_round_trip(self):
+    from numeric import to_array, from_array
+    for mode in ('L', 'RGB'):
+      image = fixture_page(mode)
+      self.assertSameImage(from_array(to_array(image), mode), image)
+
+  def test_min_filter(self):
+    from numeric import min_filter
+    for mode in ('L', 'RGB'):
+      image = fixture_page(mode)
+      for size in (3, 5, 7):
+        self.assertSameImage(min_filter(image, size),
+                             image.filter(ImageFilter.MinFilter(size)))
+
+  def test_small_images(self):
+    from numeric import min_filter
+    for size in ((1, 1), (1, 7), (7, 1), (2, 3)):
+      image = fixture_page('L', size)
+      self.assertSameImage(min_filter(image),
+                           image.filter(ImageFilter.MinFilter(3)))
+
+  def test_pipeline(self):
+    # crop, dilate and resize for the modes of the prs500 profiles, then
+    # enhance the edges of the outputs as BaseOutput.add_page does
+    modes = [ PortraitMode(565, 754),
+              LandscapeMode(565, 754, DEFAULT_OVERLAP_V, 'right') ]
+    image = fixture_page('L', (850, 1100))
+    for dilation in (3, 5):
+      pil  = process_image(image, modes, DEFAULT_CROP_PERCENT,
+                           engine='pil', dilation=dilation)
+      fast = process_image(image, modes, DEFAULT_CROP_PERCENT,
+                           engine='numpy', dilation=dilation)
+      for expected, actual in zip(pil, fast):
+        self.assertEqual(len(actual), len(expected))
+        for first, second in zip(expected, actual):
+          edge = EdgeEnhanceFilter(DEFAULT_EDGE_ENHANCE)
+          self.assertSameImage(second.filter(edge), first.filter(edge))
+
+if __name__ == '__main__':
+  unittest.main()